@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+    Stand-in for 'arp-scan -l' that reports a synthetic network, in the arp-scan output format.
+
+    usage: python benchmarks/fake_arpscan.py <hosts> [cycle] [churn] [seed]
+        hosts: the nr of hosts on the network.
+        cycle: the scan cycle, the set of absent hosts changes every cycle.
+        churn: the fraction of the hosts that is absent in a cycle (0..1).
+        seed:  seed for the selection of absent hosts.
+"""
+
+import sys, random
+
+
+def mac(index):
+    """the mac address of the synthetic host with the given index."""
+    return '02:00:%02x:%02x:%02x:%02x' % ((index >> 24) & 0xff, (index >> 16) & 0xff, (index >> 8) & 0xff, index & 0xff)
+
+
+def ip(index):
+    """the ip address of the synthetic host with the given index."""
+    return '10.%d.%d.%d' % (((index + 1) >> 16) & 0xff, ((index + 1) >> 8) & 0xff, (index + 1) & 0xff)
+
+
+def absent(hosts, cycle, churn, seed):
+    """the set of host indexes that don't reply in the given cycle."""
+    if not churn or not cycle:
+        return set()
+    rnd = random.Random(seed * 100003 + cycle)
+    return set(rnd.sample(xrange(hosts), int(hosts * churn)))
+
+
+def main(argv):
+    hosts = int(argv[0])
+    cycle = int(argv[1]) if len(argv) > 1 else 0
+    churn = float(argv[2]) if len(argv) > 2 else 0.0
+    seed = int(argv[3]) if len(argv) > 3 else 0
+    gone = absent(hosts, cycle, churn, seed)
+    out = sys.stdout
+    out.write('Interface: eth0, datalink type: EN10MB (Ethernet)\n')
+    out.write('Starting arp-scan 1.9 with %d hosts (http://www.nta-monitor.com/tools/arp-scan/)\n' % hosts)
+    for index in xrange(hosts):
+        if index not in gone:
+            out.write('%s\t%s\n' % (ip(index), mac(index)))
+    out.write('\n')
+    out.write('%d packets received by filter, 0 packets dropped by kernel\n' % (hosts - len(gone)))
+    out.write('Ending arp-scan 1.9: %d hosts scanned in 1.000 seconds. %d responded\n' % (hosts, hosts - len(gone)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
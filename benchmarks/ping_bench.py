@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+    Microbenchmark: cpu cost of sending a single ping.
+
+    'before' is the way ping.do_one used to work: look up the icmp protocol, open a raw socket,
+    resolve the address, build the payload and checksum it 1 byte at a time, for every ping.
+    'after' uses a long lived ping.IcmpProber: 1 socket, a prebuilt packet template and an
+    incremental checksum update.
+
+    usage: python benchmarks/ping_bench.py [count] [--send]
+        --send: also send the packets to 127.0.0.1 (needs root), otherwise only the packet
+                preparation is measured.
+"""
+
+import os, sys, socket, struct, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pygate_arpscanner'))
+import ping
+
+
+def legacy_checksum(source_string):
+    """the checksum as it was calculated before: 1 byte at a time."""
+    sum = 0
+    countTo = (len(source_string)/2)*2
+    count = 0
+    while count<countTo:
+        thisVal = ord(source_string[count + 1])*256 + ord(source_string[count])
+        sum = sum + thisVal
+        sum = sum & 0xffffffff
+        count = count + 2
+    if countTo<len(source_string):
+        sum = sum + ord(source_string[len(source_string) - 1])
+        sum = sum & 0xffffffff
+    sum = (sum >> 16)  +  (sum & 0xffff)
+    sum = sum + (sum >> 16)
+    answer = ~sum
+    answer = answer & 0xffff
+    answer = answer >> 8 | (answer << 8 & 0xff00)
+    return answer
+
+
+def legacy_packet(ID, sequence):
+    """builds the packet the way send_one_ping used to."""
+    header = struct.pack("bbHHh", ping.ICMP_ECHO_REQUEST, 0, 0, ID, sequence)
+    bytesInDouble = struct.calcsize("d")
+    data = (192 - bytesInDouble) * "Q"
+    data = struct.pack("d", ping.default_timer()) + data
+    my_checksum = legacy_checksum(header + data)
+    header = struct.pack("bbHHh", ping.ICMP_ECHO_REQUEST, 0, socket.htons(my_checksum), ID, sequence)
+    return header + data
+
+
+def before(count, send):
+    ID = os.getpid() & 0xFFFF
+    for sequence in xrange(count):
+        icmp = socket.getprotobyname("icmp")
+        if send:
+            my_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, icmp)
+        dest_addr = socket.gethostbyname("127.0.0.1")
+        packet = legacy_packet(ID, sequence & 0x7FFF)
+        if send:
+            my_socket.sendto(packet, (dest_addr, 1))
+            my_socket.close()
+
+
+def after(count, send):
+    if send:
+        prober = ping.IcmpProber()
+        template = prober.template
+    else:
+        template = ping.EchoTemplate(os.getpid() & 0xFFFF)
+    for sequence in xrange(count):
+        dest_addr = ping.resolve("127.0.0.1")
+        packet = template.build(sequence & 0x7FFF)
+        if send:
+            prober.socket.sendto(packet, (dest_addr, 1))
+    if send:
+        prober.close()
+
+
+def measure(func, count, send):
+    start = time.clock()                    # cpu time on unix
+    func(count, send)
+    return (time.clock() - start) / count
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    count = int(args[0]) if args else 20000
+    send = '--send' in sys.argv
+    old = measure(before, count, send)
+    new = measure(after, count, send)
+    print "pings: %s, %s" % (count, "including send" if send else "packet preparation only")
+    print "before: %8.2f us cpu per ping" % (old * 1e6)
+    print "after:  %8.2f us cpu per ping" % (new * 1e6)
+    print "speedup: %.1fx" % (old / new)
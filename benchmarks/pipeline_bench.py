@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+"""
+    Benchmark of the scan -> update -> ping -> publish pipeline on a simulated network.
+    Runs offline, without root: the network is simulated by
+        - fake_arpscan.py, used as the arp command, which reports N synthetic hosts,
+        - a fake icmp socket that answers the echo requests with configurable loss and latency,
+        - a stub pygate_core.device.Device that counts (and optionally delays) the messages sent to the cloud.
+    Every cycle a fraction of the hosts (the churn) is absent, so joins and departures are part of the work.
+
+    Reported per scenario (averages per cycle, the first cycle is not included: every device joins in it):
+        scan        wall / cpu time of scanNetwork (the cpu time of the arp command itself is reported separately)
+        update      time spent in updateAssetStates for the scan result: the time the engine's loop is held
+                    (includes writing the joins and departures to an event log in a temporary directory)
+        ping        1 refresh period of the engine's Pinger (ProbeScheduler + non-blocking sends and replies, the
+                    updates for the ping results): the nr of pings and replies, the cpu time of the process and the
+                    time the pinger's tasks held the engine's loop
+        msgs        nr of messages sent to the cloud
+        publish     time between the flush of the cycle and the last message sent
+
+    usage: python benchmarks/pipeline_bench.py [--sizes 10,1000,10000] [--churn 0,0.01,0.1] [--cycles 5]
+                                               [--loss 0.0] [--latency 0.001] [--cloud-latency 0.0] [--json]
+"""
+
+import os, sys, time, types, json, heapq, random, select, socket, argparse, shutil, tempfile
+from threading import Thread, Condition
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+import fake_arpscan
+
+
+class StubDevice(object):
+    """replacement for pygate_core.device.Device: keeps the values in memory and counts the messages."""
+    delay = 0.0                                     # simulated cloud latency per message.
+
+    def __init__(self, moduleName, deviceId):
+        self.values = {}
+        self.messages = 0
+        self.lastSend = None
+
+    def getValue(self, name):
+        return self.values.get(name)
+
+    def send(self, value, name):
+        if self.delay:
+            time.sleep(self.delay)
+        self.values[name] = value
+        self.messages += 1
+        self.lastSend = time.time()
+
+    def addAsset(self, *args):
+        pass
+
+    def createDevice(self, *args):
+        pass
+
+
+def installStubCore():
+    """makes 'from pygate_core import config, cloud, device, modules' work without the gateway."""
+    core = types.ModuleType('pygate_core')
+    for name in ('config', 'cloud', 'device', 'modules'):
+        module = types.ModuleType('pygate_core.' + name)
+        setattr(core, name, module)
+        sys.modules['pygate_core.' + name] = module
+    core.device.Device = StubDevice
+    sys.modules['pygate_core'] = core
+
+
+class FakeIcmpSocket(object):
+    """
+    behaves like a non-blocking raw icmp socket towards ping.IcmpProber: echo requests that are sent
+    are answered by a responder thread after the latency, unless they are lost or the host is down.
+    A pipe signals the available replies, so select works on it.
+    """
+    def __init__(self, loss, latency, seed=0):
+        self.loss = loss
+        self.latency = latency
+        self.down = set()                           # ip addresses that don't answer.
+        self._random = random.Random(seed)
+        self._readFd, self._writeFd = os.pipe()
+        self._due = []                              # heap of (time, seq, ip, reply)
+        self._ready = []
+        self._seq = 0
+        self.replies = 0                            # nr of replies that were received.
+        self._cond = Condition()
+        self._blocking = True
+        self._running = True
+        self._thread = Thread(target=self._respond)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def fileno(self):
+        return self._readFd
+
+    def setblocking(self, flag):
+        self._blocking = flag
+
+    def sendto(self, packet, address):
+        ip = address[0]
+        if ip in self.down or self._random.random() < self.loss:
+            return len(packet)
+        reply = '\x45' + '\x00' * 19 + '\x00' + packet[1:]         # ip header + echo reply (type 0)
+        self._cond.acquire()
+        try:
+            self._seq += 1
+            heapq.heappush(self._due, (time.time() + self.latency, self._seq, ip, reply))
+            self._cond.notify()
+        finally:
+            self._cond.release()
+        return len(packet)
+
+    def _respond(self):
+        self._cond.acquire()
+        try:
+            while self._running:
+                if not self._due:
+                    self._cond.wait(0.1)
+                    continue
+                wait = self._due[0][0] - time.time()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                due, seq, ip, reply = heapq.heappop(self._due)
+                self._ready.append((reply, (ip, 0)))
+                os.write(self._writeFd, 'x')
+        finally:
+            self._cond.release()
+
+    def recvfrom(self, size):
+        if not self._blocking:
+            if not select.select([self._readFd], [], [], 0)[0]:
+                raise socket.error(11, 'Resource temporarily unavailable')
+        os.read(self._readFd, 1)
+        self._cond.acquire()
+        try:
+            self.replies += 1
+            return self._ready.pop(0)
+        finally:
+            self._cond.release()
+
+    def close(self):
+        self._cond.acquire()
+        try:
+            self._running = False
+            self._cond.notify()
+        finally:
+            self._cond.release()
+        self._thread.join()
+        os.close(self._readFd)
+        os.close(self._writeFd)
+
+
+class LoopMonitor(object):
+    """the engine's monitor: adds up the time that the tasks held the loop."""
+    def __init__(self):
+        self.hold = 0.0
+
+    def loopTask(self, wait, hold):
+        self.hold += hold
+
+
+def runLoop(scanner, seconds):
+    """
+    runs the engine's loop in this thread for a while. Unlike stop, the timers (of the pinger) stay, so the
+    loop can be run again: the work of the pinger doesn't overlap with the measurement of the scan.
+    """
+    engine = scanner._engine
+    engine.callLater(seconds, setattr, engine, 'isRunning', False)
+    engine.run()
+
+
+def resetState(scanner, size):
+    scanner._tracked_devices.clear()
+    scanner._present_devices.clear()
+    scanner._suspect_devices.clear()
+    scanner._device_interfaces.clear()
+    scanner._interfaces = []
+    scanner._min_departure_count = 1
+    scanner._refresh_frequency = 1
+    scanner.loadAssets([fake_arpscan.mac(index) for index in xrange(size)])
+    scanner._event_log = scanner.eventlog.EventLog(tempfile.mkdtemp(prefix='arpscanner-events-'), scanner.presentDevices)
+
+
+def waitForPublish(scanner, timeout=30):
+    """waits until the publisher has sent everything, returns the time it took."""
+    start = time.time()
+    scanner._publisher.flush()
+    stable = 0
+    lastSent = -1
+    while time.time() - start < timeout:
+        stats = scanner._publisher.getStats()
+        sent = stats['sent'] + stats['failed']
+        if stats['depth'] == 0 and sent == lastSent:
+            stable += 1
+            if stable >= 2:
+                break
+        else:
+            stable = 0
+        lastSent = sent
+        time.sleep(0.01)
+    if scanner._device.lastSend and scanner._device.lastSend > start:
+        return scanner._device.lastSend - start
+    return 0.0
+
+
+def runScenario(scanner, ping, size, churn, cycles, loss, latency, seed=1):
+    resetState(scanner, size)
+    network = FakeIcmpSocket(loss, latency, seed)
+    pinger = scanner.Pinger(ping.IcmpProber(my_socket=network))
+    monitor = LoopMonitor()
+    results = []
+    try:
+        for cycle in xrange(cycles + 1):
+            row = {}
+            scanner._arp_command = '%s %s %d %d %s %d' % (sys.executable, os.path.join(BENCH_DIR, 'fake_arpscan.py'), size, cycle, churn, seed)
+            messages = scanner._device.messages
+            childCpu = os.times()[2]
+
+            wall, cpu = time.time(), time.clock()
+            found, excluded, sweeps = scanner.scanNetwork()
+            row['scan_ms'] = (time.time() - wall) * 1000
+            row['scan_cpu_ms'] = (time.clock() - cpu) * 1000
+            row['arp_command_cpu_ms'] = (os.times()[2] - childCpu) * 1000
+            row['hosts_seen'] = len(found)
+
+            wall = time.time()
+            scanner.updateAssetStates(found)
+            row['update_ms'] = (time.time() - wall) * 1000
+
+            network.down = set(fake_arpscan.ip(index) for index in fake_arpscan.absent(size, cycle, churn, seed))
+            pings, replies, monitor.hold = pinger.scheduler.probes, network.replies, 0.0
+            cpu = time.clock()
+            scanner._engine.monitor = monitor
+            runLoop(scanner, scanner._refresh_frequency)
+            scanner._engine.monitor = None
+            row['ping_cpu_ms'] = (time.clock() - cpu) * 1000
+            row['ping_hold_ms'] = monitor.hold * 1000
+            row['pings'] = pinger.scheduler.probes - pings
+            row['ping_replies'] = network.replies - replies
+
+            row['publish_ms'] = waitForPublish(scanner) * 1000
+            row['msgs'] = scanner._device.messages - messages
+            results.append(row)
+    finally:
+        pinger.close()
+        scanner._event_log.close()
+        shutil.rmtree(scanner._event_log.directory)
+    return results
+
+
+def summarize(size, churn, rows):
+    measured = rows[1:] or rows
+    summary = {'devices': size, 'churn': churn, 'first_cycle_msgs': rows[0]['msgs']}
+    for key in rows[0]:
+        summary[key] = sum(row[key] for row in measured) / float(len(measured))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark of the arp scanner pipeline on a simulated network')
+    parser.add_argument('--sizes', default='10,1000,10000', help='comma separated nr of tracked devices')
+    parser.add_argument('--churn', default='0,0.01,0.1', help='comma separated fraction of the devices that is absent per cycle')
+    parser.add_argument('--cycles', type=int, default=5, help='nr of measured cycles per scenario')
+    parser.add_argument('--loss', type=float, default=0.0, help='fraction of the pings that is lost')
+    parser.add_argument('--latency', type=float, default=0.001, help='ping round trip time, in seconds')
+    parser.add_argument('--cloud-latency', type=float, default=0.0, help='time it takes to send 1 message to the cloud, in seconds')
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    args = parser.parse_args()
+
+    installStubCore()
+    StubDevice.delay = args.cloud_latency
+    import pygate_arpscanner as scanner
+    from pygate_arpscanner import ping
+    directory = tempfile.mkdtemp(prefix='arpscanner-bench-')
+    scanner._snapshot_path = os.path.join(directory, 'devices.snapshot')
+    scanner._event_log_dir = None                   # every scenario logs to it's own directory.
+    scanner.connectToGateway('benchmark')
+    runLoop(scanner, 0.1)                           # the startup tasks, before the scenarios load their devices.
+
+    summaries = []
+    for size in [int(value) for value in args.sizes.split(',')]:
+        for churn in [float(value) for value in args.churn.split(',')]:
+            rows = runScenario(scanner, ping, size, churn, args.cycles, args.loss, args.latency)
+            summaries.append(summarize(size, churn, rows))
+    scanner._publisher.stop()
+    scanner._publisher.join()
+    shutil.rmtree(directory)
+
+    if args.json:
+        print json.dumps(summaries, indent=2, sort_keys=True)
+        return
+    columns = ['devices', 'churn', 'hosts_seen', 'scan_ms', 'scan_cpu_ms', 'arp_command_cpu_ms', 'update_ms', 'pings', 'ping_replies', 'ping_cpu_ms', 'ping_hold_ms', 'msgs', 'publish_ms', 'first_cycle_msgs']
+    print ' '.join('%12s' % column[:12] for column in columns)
+    for summary in summaries:
+        print ' '.join('%12.2f' % summary[column] if isinstance(summary[column], float) else '%12s' % summary[column] for column in columns)
+
+
+if __name__ == '__main__':
+    main()
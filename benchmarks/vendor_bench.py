@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+    Microbenchmark: vendor lookups of the visible devices.
+
+    'dict' is the straightforward way: parse the OUI text file into a dict at startup and look the prefixes up in it.
+    'index' uses vendors.VendorIndex: the file is compiled once into a sorted binary index, which is memory mapped
+    and searched by bisection.
+    Reported: the startup cost (compile, parse / open) and the lookup time per mac.
+
+    usage: python benchmarks/vendor_bench.py [oui.txt] [--lookups 10000]
+        without a file, a synthetic list of 30000 vendors in the IEEE format is generated.
+"""
+
+import os, sys, time, random, argparse, shutil, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pygate_arpscanner'))
+import vendors
+
+
+def writeSynthetic(path, count, seed=0):
+    """writes an OUI list in the format of the IEEE file, with random prefixes."""
+    rand = random.Random(seed)
+    prefixes = rand.sample(xrange(1 << 24), count)
+    with open(path, 'w') as f:
+        f.write('OUI/MA-L                                                    Organization\n')
+        f.write('company_id                                                  Organization\n')
+        f.write('                                                            Address\n\n')
+        for prefix in prefixes:
+            digits = '%06X' % prefix
+            f.write('%s-%s-%s   (hex)\t\tVendor %d Inc.\n' % (digits[0:2], digits[2:4], digits[4:6], prefix))
+            f.write('%s     (base 16)\t\tVendor %d Inc.\n' % (digits, prefix))
+            f.write('\t\t\t\tSome street %d\n\t\t\t\tSome city\n\t\t\t\tBE\n\n' % prefix)
+    return prefixes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark of the vendor lookups')
+    parser.add_argument('source', nargs='?', help='an OUI text file, a synthetic one is generated when omitted')
+    parser.add_argument('--lookups', type=int, default=10000, help='nr of macs that are looked up')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='arpscanner-vendors-')
+    try:
+        source = args.source
+        if not source:
+            source = os.path.join(directory, 'oui.txt')
+            writeSynthetic(source, 30000)
+        rand = random.Random(1)
+        macs = ['%02x:%02x:%02x:%02x:%02x:%02x' % tuple(rand.randrange(256) for i in xrange(6)) for j in xrange(args.lookups)]
+        with open(source) as f:
+            known = sorted(vendors.parse(f))
+        macs[::2] = ['%06x%06x' % (rand.choice(known), rand.randrange(1 << 24)) for j in xrange(len(macs[::2]))]      # half of them are known.
+
+        path = os.path.join(directory, 'oui.idx')
+        start = time.time()
+        count = vendors.compileIndex(source, path)
+        print "compile: %d vendors in %.1f ms, index %d KB" % (count, (time.time() - start) * 1000, os.path.getsize(path) // 1024)
+
+        start = time.time()
+        index = vendors.openIndex(path, [])
+        len(index)
+        opened = time.time() - start
+        start = time.time()
+        found = sum(1 for mac in macs if index.lookup(mac))
+        elapsed = time.time() - start
+        print "index:   open %.2f ms, lookup %.2f us/mac, %d found" % (opened * 1000, elapsed * 1e6 / len(macs), found)
+        index.close()
+
+        start = time.time()
+        with open(source) as f:
+            table = vendors.parse(f)
+        parsed = time.time() - start
+        start = time.time()
+        found = sum(1 for mac in macs if table.get(int(mac.replace(':', '')[:6], 16)))
+        elapsed = time.time() - start
+        print "dict:    parse %.2f ms, lookup %.2f us/mac, %d found" % (parsed * 1000, elapsed * 1e6 / len(macs), found)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
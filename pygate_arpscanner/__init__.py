@@ -7,64 +7,282 @@ __status__ = "Prototype"  # "Development", or "Production"
 
 import logging
 logger = logging.getLogger('arpscanner')
-import os,subprocess
-from time import sleep
+import os
+import time
 import json
-from threading import Lock, Thread, Event
-import datetime
+import socket
+import struct
+import tempfile
+from threading import Lock
 import ping
+import arpsweep
+import listener
+import neighbours
+import parsers
+import publisher
+import scheduler
+import multiscan
+import engine
+import metrics
+import registry
+import snapshot
+import eventlog
+import discovery
+import scanservice
+import vendors
 
 from pygate_core import config, cloud , device, modules
 
 
 _device = None
-_tracked_devices = {}                # dict of devices that need to be tracked. each device is an object, cause we need to store state info locally.
-_tracked_devices_lock = Lock()
-_isRunning = True
+_publisher = None                   # sends the state changes to the cloud, so the scanning doesn't have to wait for the network.
+_tracked_devices = registry.Registry()  # the devices that need to be tracked, by mac (as integer). each device is an object, cause we need to store state info locally.
+_present_devices = set()            # macs (as integers) of the tracked devices that are currently present, so a cycle only has to look at the changes.
+_suspect_devices = set()            # macs of present devices that were missed in a recent cycle (changeCount > 0).
 _arp_command = None
-_pinger = None                      # maintains a ref to the thread that performs the pinging.
+_engine = engine.Engine()           # runs the scans, pings and actuator requests. All the tracked device state is only touched from it's loop, so it needs no lock.
+_pinger = None                      # maintains a ref to the object that performs the pinging.
+_scanning = False                   # True while a scan is running on the engine's worker thread.
+_scan_started = None                # the time at which the current/last scan was started.
+_scan_timer = None                  # the timer for the next scan.
+_listener = None                    # maintains a ref to the thread that passively listens for arp/dhcp traffic.
 _min_departure_count = None         # the minimum count that a device has to be seen as gone before labeling it as such (to prevent wobbles when high sampling frequencies are used
 _refresh_frequency = None           # the rate at which the data is refreshed, in seconds.
+_native_scanners = {}               # interface -> built-in arp scanner, when the arp command selects it. Keeps it's socket open between scans.
+_neighbour_monitor = None           # follows the kernel neighbour table, when the arp command selects it.
+_native_scanner_lock = Lock()       # the interfaces are scanned from multiple worker threads at the same time.
+_sweep_rate = None                  # max nr of arp requests (and pings) per second, None for no limit.
+_sweep_budget = None                # max nr of seconds that a sweep of the built-in scanner can take, the rest is done in the next cycle.
+_sweep_results = {}                 # interface -> (coverage, skipped addresses) of the built-in scans of the current cycle.
+_interfaces = []                    # list of (interface or subnet, timeout) that are scanned in parallel. When empty, only the arp command itself is used.
+_device_interfaces = {}             # mac -> the interface on which the device was last seen, when multiple interfaces are scanned.
+_multi_scanner = multiscan.MultiScanner()
+_scan_timeout = 30                  # max nr of seconds that the arp command is allowed to run, after that it is killed.
+_ping_timeout = 0.5                 # max nr of seconds that a ping sweep waits for replies.
+_metrics = None                     # the performance metrics, only collected when diagnostics are turned on.
+_metrics_config = None              # (publish, path, interval) of the diagnostics, None when turned off.
+_metrics_timer = None               # the timer for the next metrics report.
+_data_dir = os.environ.get('ARPSCANNER_DATA_DIR') or os.path.dirname(os.path.abspath(__file__))     # where the snapshot, the event log and the vendor index are kept.
+_snapshot_path = os.path.join(_data_dir, 'devices.snapshot')     # the local copy of the state of the tracked devices, for a warm start.
+_snapshot_interval = 60             # nr of seconds between 2 writes of the snapshot, it is only written when the presence or the address of a device changed,
+_snapshot_max_age = 600             # or when the last write is older than this, so the last seen times are kept up to date.
+_snapshot_dirty = False             # True when the presence state or an address changed since the last write.
+_snapshot_written = 0               # the time of the last write of the snapshot.
+_snapshot_timer = None
+_warm_state = None                  # the content of the snapshot while the tracked devices are loaded at startup.
+_event_log_dir = os.path.join(_data_dir, 'events')     # the log of all the joins and departures, None to turn it off.
+_event_log = None
+_confirmer = None                   # re-probes the devices that were missed by a scan, when departures are confirmed.
+_confirm_attempts = 3               # nr of probe rounds before a missed device is reported gone.
+_confirm_interval = 0.3             # nr of seconds between 2 probe rounds.
+_scan_mode = discovery.FULL_MODE    # 'tracked': only the addresses of the tracked devices + a slice of the subnet are scanned.
+_discoveries = {}                   # interface or subnet -> Discovery, for the tracked-only scans.
+_discovery_lock = Lock()            # the discoveries are used from the scan threads.
+_discovery_slice = 256              # nr of addresses of the subnet that are added to every tracked-only scan.
+_visible_devices = {}               # mac -> (ip, scan cycle) of the devices found by the tracked-only scans, they are reported as the visible devices.
+_scan_cycle = 0
+_scan_service = scanservice.ScanService(lambda trackedIps: scanNetwork(trackedIps))     # makes all the scan requests share 1 scan at a time.
+_scan_ttl = 2                       # max age in seconds of a scan result that is reused for a refresh of the visible devices.
+_published_visible = None           # the visible devices that were last published, the next publish only sends the changes.
+_unsent_presence = set()            # macs of the tracked devices whose presence state failed to send or was dropped, it's sent again with the next batch.
+_vendor_index_path = os.path.join(_data_dir, 'oui.idx')     # the compiled OUI list.
+_vendor_sources = [os.path.join(_data_dir, 'oui.txt')] + vendors.DEFAULT_SOURCES     # the OUI text files it is compiled from, the first one that exists.
+_show_vendors = False               # True when the visible devices are sent with the name of their vendor.
+_vendors = None                     # the vendor index, only opened when the vendors are shown.
 
-_pinger_wake_up_event = Event()
-_main_wake_up_event = Event()
 
+class PingBatch:
+    def __init__(self, probed):
+        self.probed = set(probed)           # the macs that were pinged.
+        self.found = {}                     # mac -> ip of the devices that replied.
+        self.keys = []                      # the (ip, sequence) of the pings that were sent.
+
+class Pinger:
+    """
+    pings the present devices to detect departures. Each device is pinged at it's own rate:
+    stable devices less often, devices that are suspected to have left more often.
+    Runs on the engine's loop: the pings are sent and received over a non-blocking socket.
+    """
+    def __init__(self, prober=None):
+        """:param prober: optional ping.IcmpProber to use, by default one with a raw socket is opened."""
+        self.scheduler = scheduler.ProbeScheduler(_refresh_frequency)
+        self._maxRate = self.scheduler.maxRate
+        self.prober = prober or ping.IcmpProber()
+        self.prober.socket.setblocking(0)
+        self._sequence = 0
+        self._pending = {}                  # (ip, sequence) -> batch, the mac is found through the ip index of the tracked devices.
+        self._suspects = set()
+        _engine.addReader(self.prober.socket, self.onReadable)
+        self._timer = _engine.callLater(0, self.tick)
+
+    def close(self):
+        self._timer.cancel()
+        _engine.removeReader(self.prober.socket)
+        self.prober.close()
+
+    def reschedule(self):
+        """wake up again when the next device is due, or after the refresh rate."""
+        self._timer.cancel()
+        nextDue = self.scheduler.nextDue()
+        wait = _refresh_frequency
+        if nextDue:
+            wait = min(nextDue - time.time(), wait)
+        self._timer = _engine.callLater(max(wait, 0), self.tick)
+
+    def tick(self):
+        now = time.time()
+        self.scheduler.baseInterval = _refresh_frequency
+        self.scheduler.maxRate = min(_sweep_rate or self._maxRate, self._maxRate)
+        self.scheduler.sync(_present_devices, now)      # the ip is only looked up for the devices that are due: this runs many times per second.
+        for mac in _suspect_devices - self._suspects:     # missed by the arp scan: confirm quickly.
+            self.scheduler.expedite(mac, now)
+        self._suspects = set(_suspect_devices)
+        due = self.scheduler.getDue(now)
+        if due:
+            self.send(due, now)
+        self.reschedule()
+
+    def send(self, due, now):
+        """pings all the devices that are due at once, the result is processed after the ping timeout."""
+        targets = {}
+        for mac in due:
+            ip = _tracked_devices[mac].ip
+            if ip:
+                targets[mac] = ip
+            else:                                       # if the dev has no ip, it is not on the network (or not yet seen, so don't ping).
+                self.scheduler.reportResult(mac, True, False, now)
+        if not targets:
+            return
+        batch = PingBatch(targets)
+        for mac, ip in targets.iteritems():
+            self._sequence = (self._sequence + 1) & 0x7FFF
+            try:
+                self.prober.send(ip, self._sequence)
+            except socket.error:
+                continue                                # counts as no reply.
+            key = (ip, self._sequence)
+            self._pending[key] = batch
+            batch.keys.append(key)
+        _engine.callLater(_ping_timeout, self.finishBatch, batch)
+
+    def onReadable(self):
+        for ip, sequence, delay in self.prober.read_replies():
+            batch = self._pending.pop((ip, sequence), None)
+            if batch:
+                mac = _tracked_devices.byIp(ip)
+                if mac not in batch.probed:             # the address was given to another device in the mean time.
+                    continue
+                batch.found[mac] = ip
+                _tracked_devices[mac].rtt = delay
+                if _metrics:
+                    _metrics.observeRtt(mac, delay)
+
+    def finishBatch(self, batch):
+        for key in batch.keys:
+            self._pending.pop(key, None)
+        updateAssetStates(batch.found, batch.probed)
+        now = time.time()
+        for mac in batch.probed:
+            self.scheduler.reportResult(mac, mac in batch.found, mac in _suspect_devices, now)
+        self.reschedule()
 
-class Tracked:
-    def __init__(self, name):
-        # note: we dnon't need to store the value, this is stored in the assetStateCache.
-        self.name = name
-        self.ip = None                      # the ip address for this device being tracked.
-        self.changeCount = 0                # sometimes a device disapears 1 cycle, but it's still there, so we compensate
 
-class Pinger(Thread):
+class Confirmer:
+    """
+    decides quickly whether a device that was missed by a scan really left: a unicast arp request and a ping are
+    sent to it's last known address, a few times at short intervals. The first reply keeps it present, without one
+    it is reported gone after _confirm_attempts rounds. Runs on the engine's loop.
+    """
     def __init__(self):
-        Thread.__init__(self)
-        self.isRunning = True
+        self.prober = ping.IcmpProber((os.getpid() + 1) & 0xFFFF)         # another id than the pinger, so the replies don't mix.
+        self.prober.socket.setblocking(0)
+        _engine.addReader(self.prober.socket, self.onPingReplies)
+        self._arpScanners = {}              # interface -> ArpScanner, None if arp can't be used on it.
+        self._pending = {}                  # mac -> nr of probe rounds left
+        self._sequence = 0
+        self._timer = None
+
+    def close(self):
+        if self._timer:
+            self._timer.cancel()
+        _engine.removeReader(self.prober.socket)
+        self.prober.close()
+        for scanner in self._arpScanners.itervalues():
+            if scanner:
+                _engine.removeReader(scanner)
+                scanner.close()
 
-    def run(self):
-        while self.isRunning:
+    def getArpScanner(self, mac):
+        """:return: the arp scanner for the interface on which the device was seen, None if arp can't be used."""
+        interface = _device_interfaces.get(registry.formatMac(mac)) or getScanInterface()
+        if interface not in self._arpScanners:
+            scanner = arpsweep.ArpScanner(interface)
             try:
-                start = datetime.datetime.now()
-                foundDevices = {}
-                _tracked_devices_lock.acquire()
-                try:
-                    devs = dict(_tracked_devices)       # make a local copy of the dict, so the list can be modified by the other thread.
-                finally:
-                    _tracked_devices_lock.release()
-                for key, dev in devs:
-                    if dev.ip and ping.do_one(dev.ip, 500):            #timeout as fast as possible. if the dev has no ip, it is not on the network (or not yet seen, so don't ping).
-                        foundDevices[dev.mac] = dev.ip
-                updateAssetStates(foundDevices)
-                refresh_every = datetime.timedelta(seconds=_refresh_frequency)
-                time_dif = (datetime.datetime.now() - start)
-                if time_dif < refresh_every:
-                    time_dif = refresh_every - time_dif
-                    _pinger_wake_up_event.wait(time_dif.total_seconds())        #wake up if the service stops.
-                else:
-                    logger.error("pinger time overrun: pinging took longer than refresh rate")
-            except:
-                logger.exception("ping thread failed")
+                scanner.open()
+                _engine.addReader(scanner, self.onArpReplies)
+            except Exception:                               # not linux, not root or not an interface (a subnet): ping only.
+                logger.warning("departures on %s can't be confirmed with arp, only with ping", interface)
+                scanner = None
+            self._arpScanners[interface] = scanner
+        return self._arpScanners[interface]
+
+    def confirm(self, mac, tracked):
+        """
+        starts probing a device that was missed.
+        :return: False if the device can't be probed (the address is unknown), the caller then decides.
+        """
+        if not tracked.ip:
+            return False
+        if mac not in self._pending:
+            self._pending[mac] = _confirm_attempts
+            self.probe(mac, tracked)
+            if not self._timer:
+                self._timer = _engine.callLater(_confirm_interval, self.tick)
+        return True
+
+    def probe(self, mac, tracked):
+        self._pending[mac] -= 1
+        scanner = self.getArpScanner(mac)
+        try:
+            if scanner:
+                scanner.send(struct.unpack('!I', socket.inet_aton(tracked.ip))[0], struct.pack('!Q', mac)[2:])
+            self._sequence = (self._sequence + 1) & 0x7FFF
+            self.prober.send(tracked.ip, self._sequence)
+        except socket.error:
+            pass                                            # counts as no reply.
+
+    def tick(self):
+        """the next probe round: the devices that didn't reply to the last round are probed again or reported gone."""
+        self._timer = None
+        for mac, left in self._pending.items():
+            if mac not in _suspect_devices:                 # seen in the mean time.
+                del self._pending[mac]
+            elif left <= 0:
+                del self._pending[mac]
+                setPresent(mac, _tracked_devices[mac], False)
+            else:
+                self.probe(mac, _tracked_devices[mac])
+        flushChanges()
+        if self._pending:
+            self._timer = _engine.callLater(_confirm_interval, self.tick)
+
+    def replied(self, mac):
+        if self._pending.pop(mac, None) is not None:
+            _tracked_devices[mac].changeCount = 0
+            _suspect_devices.discard(mac)
+
+    def onPingReplies(self):
+        for ip, sequence, delay in self.prober.read_replies():
+            mac = _tracked_devices.byIp(ip)
+            if mac is not None:
+                _tracked_devices[mac].rtt = delay
+                self.replied(mac)
+
+    def onArpReplies(self):
+        for scanner in self._arpScanners.itervalues():
+            if scanner:
+                for mac in _tracked_devices.match(scanner.readReplies()):
+                    self.replied(mac)
 
 
 VISIBLE_DEV_ID = "visibledev"           # id for assets
@@ -75,12 +293,25 @@ USE_PING_ID = "useping"
 DEV_ID = 'arpscanner'
 MIN_DEPARTURE_CNT_ID = "mindeparturecount"
 REFRESH_FREQ_ID = "refreshfrequency"
+PASSIVE_ID = "passive"
+INTERFACES_ID = "interfaces"
+CONFIRM_ID = "confirmdepartures"
+SCAN_MODE_ID = "scanmode"
+DIAGNOSTICS_ID = "diagnostics"
+METRICS_ID = "metrics"
+SWEEP_ID = "sweep"
+VENDORS_ID = "vendors"
 
 def connectToGateway(moduleName):
     '''optional
         called when the system connects to the cloud.'''
-    global _device
+    global _device, _publisher
     _device = device.Device(moduleName, DEV_ID)
+    if not os.path.isdir(_data_dir):
+        os.makedirs(_data_dir)
+    _publisher = publisher.Publisher(_device)
+    _publisher.onFailed = publishFailed
+    _publisher.start()
 
 
 def loadAssets(list):
@@ -90,13 +321,37 @@ def loadAssets(list):
     :return: None
     """
     if list:
-        _tracked_devices_lock.acquire()
-        try:
-            for item in list:
-                name = str(item.replace(':', ''))        # remove unwanted signes from the label, so we can use it as name for the asset
-                _tracked_devices[str(item)] = Tracked(name)
-        finally:
-            _tracked_devices_lock.release()
+        for item in list:
+            name = str(item.replace(':', ''))        # remove unwanted signes from the label, so we can use it as name for the asset
+            addTracked(str(item), name)
+
+
+def addTracked(mac, name):
+    """
+    adds a device to the list of tracked devices. The presence state is loaded from the asset state cache,
+    this is the only time that it is read. Runs on the engine's loop.
+    :param mac: the mac address of the device
+    :param name: the name of the asset
+    :return: None
+    """
+    try:
+        key = registry.macToInt(mac)
+    except ValueError:
+        logger.error("can't track '%s': not a mac address", mac)
+        return
+    warm = _warm_state.pop(key, None) if _warm_state else None
+    if warm:                                                # the snapshot knows the last state that was sent.
+        present, ip, lastSeen, changeCount = warm
+        tracked = _tracked_devices.add(key, name, present)
+        _tracked_devices.setIp(tracked, ip)
+        tracked.lastSeen = lastSeen
+        if present and changeCount:
+            tracked.changeCount = changeCount
+            _suspect_devices.add(key)
+    else:
+        tracked = _tracked_devices.add(key, name, _device.getValue(name) == True)
+    if tracked.present:
+        _present_devices.add(tracked.key)
 
 
 
@@ -109,47 +364,55 @@ def syncAssets(new, current):
     :param current: the list of asset names currently defined in the system.
     :return:  None
     """
-    _tracked_devices_lock.acquire()
-    try:
-        for item in new:
-            name = str(item.replace(':', ''))
-            item = str(item)
-            if not item in current:
-                _device.addAsset(name, item, "presence of device", "sensor", "boolean")
-            if not item in _tracked_devices:
-                _tracked_devices[item] = Tracked(name)
-    finally:
-        _tracked_devices_lock.release()
+    for item in new:
+        name = str(item.replace(':', ''))
+        item = str(item)
+        if not item in current:
+            _device.addAsset(name, item, "presence of device", "sensor", "boolean")
+        if not item in _tracked_devices:
+            addTracked(item, name)
     # don't delete any
 
 def syncDevices(existing, full):
     '''optional
        allows a module to synchronize it's device list.
        existing: the list of devices that are already known in the cloud for this module.'''
-    global _arp_command, _min_departure_count, _refresh_frequency
+    global _arp_command, _min_departure_count, _refresh_frequency, _interfaces, _scan_mode, _sweep_rate, _sweep_budget
     if not existing:
         _device.createDevice('arp scanner', 'keep track of the connectivity state for known devices')
     else:
         _arp_command = _device.getValue(ARP_COMMAND_ID)
         _min_departure_count = _device.getValue(MIN_DEPARTURE_CNT_ID)
         _refresh_frequency = _device.getValue(REFRESH_FREQ_ID)
-        if(_device.getValue(USE_PING_ID) == True):
-            start_ping()
+        _interfaces = multiscan.parseConfig(_device.getValue(INTERFACES_ID), _scan_timeout)
+        _scan_mode = _device.getValue(SCAN_MODE_ID) or discovery.FULL_MODE
+        _sweep_rate, _sweep_budget = arpsweep.parseSweepConfig(_device.getValue(SWEEP_ID))
+        _engine.call(configureMetrics, metrics.parseConfig(_device.getValue(DIAGNOSTICS_ID)))
+    _engine.call(loadSnapshot)                                                              # before the tracked devices are loaded, they start from it.
     if not existing or full:
-        _device.addAsset(VISIBLE_DEV_ID, 'visible devices', 'The list of all visibile devices', False, 'object')
+        _device.addAsset(VISIBLE_DEV_ID, 'visible devices', 'The list of all visibile devices, sent after every scan that changed it, as the changes since the previous value: {"full": false, "added": {mac: ip}, "removed": [mac]}. When "full" is true, "added" contains all the devices', False, 'object')
         _device.addAsset(ARP_COMMAND_ID, 'arp command', 'the command used for performing the arp scan', 'virtual', 'string')
         _device.addAsset(USE_PING_ID, 'use ping', 'When true, departures will be detected using ping, which requires more resources but can be required for some routers', 'virtual','boolean')
         _device.addAsset(MIN_DEPARTURE_CNT_ID, 'min departure cnt', 'the minimum count that a device has to be seen as gone before labeling it as such - to prevent wobbles when high sampling frequencies are used', 'virtual','integer')
         _device.addAsset(REFRESH_FREQ_ID, 'refresh frequency', 'The rate at which the system tries to refresh the data, in seconds.', 'virtual','integer')
+        _device.addAsset(PASSIVE_ID, 'passive detection', 'When true, the network is also monitored for arp and dhcp traffic, so that devices are reported as soon as they connect', 'virtual', 'boolean')
+        _device.addAsset(CONFIRM_ID, 'confirm departures', 'When true, a device that is missed by a scan is probed directly (arp and ping to its last address) a few times at short intervals, and reported gone within about a second if it does not reply, instead of after "min departure cnt" scans. The scans can then run less often', 'virtual', 'boolean')
+        _device.addAsset(SCAN_MODE_ID, 'scan mode', 'full: every scan covers the whole network. tracked: a scan only covers the last known addresses of the tracked devices plus a small slice of the network, so that large networks can be scanned often. Only for arp-scan and the native scanner', 'virtual', 'string')
+        _device.addAsset(INTERFACES_ID, 'interfaces', 'The list of interfaces or subnets that are scanned in parallel, each optionally with a timeout in seconds. When empty, the arp command is used as is', 'virtual', '{"type": "array", "items":{"type":["string", "object"]}}')
+        _device.addAsset(SWEEP_ID, 'sweep limits', 'Limits the load of the scans: an object with the fields "rate" (max nr of arp requests and pings per second) and "budget" (max nr of seconds that a scan of the built-in scanner can take, the addresses it did not get to are scanned first in the next cycle). Empty for no limits', 'virtual', 'object')
+        _device.addAsset(DIAGNOSTICS_ID, 'diagnostics', 'Turns the collection of performance metrics on or off. true: publish them in the metrics asset, or an object with the fields "publish" (boolean), "file" (local path, prometheus text format or json when it ends with .json) and "interval" (seconds between reports)', 'virtual', '{"type": ["boolean", "object"]}')
+        _device.addAsset(METRICS_ID, 'metrics', 'performance metrics of the scan cycles, only sent when diagnostics are turned on', False, 'object')
+        _device.addAsset(VENDORS_ID, 'show vendors', 'When true, the visible devices are sent as {mac: {"ip": ip, "vendor": name}}, the vendor is looked up in the IEEE OUI list (oui.txt in the plugin directory or the one installed by the ieee-data or arp-scan package)', 'virtual', 'boolean')
         _device.addAsset(REFRESH_VISIBLE_DEV_ID, 'refresh visible devices', 'Refresh the list of all visibile devices',True, 'boolean')
         _device.addAsset(TRACKED_DEV_ID, 'devices being tracked', 'The list of all devices that need to be tracked. Each device becomes an asset', True, '{"type": "array", "items":{"type":"string"}}')
     if full:                        # when not existing yet, no need to sync assets, there are no extra assets yet.
         if existing and 'assets' in existing:
-            syncAssets(_device.getValue(TRACKED_DEV_ID), existing['assets'])
+            _engine.call(syncAssets, _device.getValue(TRACKED_DEV_ID), existing['assets'])
         else:
-            syncAssets(_device.getValue(TRACKED_DEV_ID), [])
+            _engine.call(syncAssets, _device.getValue(TRACKED_DEV_ID), [])
     else:
-        loadAssets(_device.getValue(TRACKED_DEV_ID))                                        # alwaye need to load these, otherwise there is no mapping loaded in memory
+        _engine.call(loadAssets, _device.getValue(TRACKED_DEV_ID))                          # alwaye need to load these, otherwise there is no mapping loaded in memory
+    _engine.call(devicesLoaded)
     if not _arp_command:                                                                    # we check at the end, this way, we set a default value right from the first time.
         if os.name == 'nt':
             _arp_command = 'arp -a'
@@ -162,134 +425,691 @@ def syncDevices(existing, full):
     if not _refresh_frequency:
         _refresh_frequency = 1
         _device.send(_refresh_frequency, REFRESH_FREQ_ID)
+    if existing:                                                                            # the pinger and listener need the config values, so start them last.
+        if(_device.getValue(USE_PING_ID) == True):
+            start_ping()
+        if(_device.getValue(PASSIVE_ID) == True):
+            start_listener()
+        if(_device.getValue(CONFIRM_ID) == True):
+            _engine.call(setConfirming, True)
+        if(_device.getValue(VENDORS_ID) == True):
+            _engine.call(setVendors, True)
 
 
 def start_ping():
     """
-    starts the ping thread that checks for devices that leave the network. If the user did not activate this feature,
+    starts pinging the devices to check if they left the network. If the user did not activate this feature,
     departures can also be detected by the arp-scan.
     :return: None.
     """
-    global _pinger
-    if not _pinger:
-        _pinger = Pinger()
-        _pinger.start()
+    _engine.call(setPinging, True)
 
 def stop_ping():
-    """stops the ping thread """
+    """stops pinging """
+    _engine.call(setPinging, False)
+
+def setPinging(enabled):
+    """creates or closes the pinger, runs on the engine's loop."""
     global _pinger
-    if _pinger:
-        _pinger.isRunning = False
+    if enabled and not _pinger:
+        _pinger = Pinger()
+    elif not enabled and _pinger:
+        _pinger.close()
         _pinger = None
-        _pinger_wake_up_event.set()
 
-def findDevices():
-    foundDevices = {}
-    # Execute arp command to find all currently known devices
-    proc = subprocess.Popen(_arp_command, shell=True, stdout=subprocess.PIPE)
-    # Build array of dictionary entries for all devices found
-    if os.name == 'nt':
-        for line in proc.stdout:
-            item = line.split()
-            if len(item) == 3 and item[2] == 'dynamic':
-                foundDevices[item[1].replace('-', ':').lower()] = item[0]
+def setConfirming(enabled):
+    """creates or closes the confirmer of departures, runs on the engine's loop."""
+    global _confirmer
+    if enabled and not _confirmer:
+        try:
+            _confirmer = Confirmer()
+        except socket.error:
+            logger.exception("departures can't be confirmed: failed to open the ping socket")
+    elif not enabled and _confirmer:
+        _confirmer.close()
+        _confirmer = None
+
+def setVendors(enabled):
+    """turns the vendor names of the visible devices on or off, runs on the engine's loop."""
+    global _show_vendors, _vendors, _published_visible
+    if enabled == _show_vendors:
+        return
+    _show_vendors = enabled
+    _published_visible = None                       # the format changes, so the next publish sends the full list.
+    if enabled:
+        _engine.runInExecutor(loadVendors, (), vendorsLoaded)          # compiling the OUI list takes a while.
+    elif _vendors:
+        _vendors.close()
+        _vendors = None
+
+def loadVendors():
+    """opens the vendor index, it is compiled first if needed. Runs on the engine's worker thread."""
+    index = vendors.openIndex(_vendor_index_path, _vendor_sources)
+    if index:
+        len(index)                                  # maps and checks the file, so lookups on the loop don't fail.
+    return index
+
+def vendorsLoaded(index, error):
+    global _vendors
+    if error:
+        logger.error("failed to load the vendor index: %s", error)
+    elif not index:
+        logger.error("no vendors: none of the OUI lists was found: %s", ", ".join(_vendor_sources))
+    elif not _show_vendors:
+        index.close()                               # turned off again while it was loading.
     else:
-        lines = []
-        for line in proc.stdout:  # skip the first 2 and last 3 lines
-            lines.append(line)
-        for line in lines[2:-3]:
-            item = line.split()
-            foundDevices[item[1].lower()] = item[0]
-    # Wait for subprocess to exit
-    proc.wait()
-    return foundDevices
+        _vendors = index
+
+def start_listener():
+    """
+    starts the thread that passively listens for arp and dhcp traffic, so that joins are detected as soon
+    as the device connects. The interface that the arp command scans is used, see getScanInterface.
+    :return: None
+    """
+    global _listener
+    if not _listener:
+        _listener = listener.PassiveListener(getScanInterface(), onDeviceSeen)
+        _listener.start()
 
+def getScanInterface():
+    """:return: the interface of the built-in arp scanner or of arp-scan's -I option, eth0 by default."""
+    if arpsweep.isNativeCommand(_arp_command):
+        return arpsweep.getInterface(_arp_command)
+    if _arp_command and parsers.getParser(_arp_command) == parsers.parseArpScan:
+        return discovery.getArpScanInterface(_arp_command)
+    return arpsweep.DEFAULT_INTERFACE
 
-def updateAssetStates(current):
+def stop_listener():
+    """stops the passive listener thread"""
+    global _listener
+    if _listener:
+        _listener.isRunning = False
+        _listener = None
+
+def findNativeDevices(interface, targets = None):
     """
-    updates the list
-    :param current: The new state, that was just discovered
-    :return:
+    performs the scan with the built-in arp scanner.
+    :param interface: the interface to scan.
+    :param targets: optional list of integer addresses of the tracked devices: only these and the next slice of the subnet are scanned.
+    :return: dict of mac -> ip
     """
-    _tracked_devices_lock.acquire()
+    _native_scanner_lock.acquire()
     try:
-        for knownMac, knownName in _tracked_devices.iteritems():
-            if knownMac in current:
-                prevVal = _device.getValue(knownName.name)
-                if not prevVal or prevVal == False:
-                    logger.info('joined: ' + knownName.name)
-                    _device.send('true', knownName.name)
-                    knownName.ip = current[knownMac]            # store the ip address so we can ping it if need be
-                else:
-                    knownName.changeCount = 0
-            elif _device.getValue(knownName.name) == True:
-                knownName.changeCount += 1
-                if knownName.changeCount > _min_departure_count:  # compensate: the device has to disapear for 2 cycles before we really report it gone.
-                    logger.info('left: ' + knownName.name)
-                    _device.send('false', knownName.name)
-                    knownName.changeCount = 0
-                    knownName.ip = None
-            else:
-                knownName.changeCount = 0
+        scanner = _native_scanners.get(interface)
+        if not scanner:
+            scanner = _native_scanners[interface] = arpsweep.ArpScanner(interface)
+    finally:
+        _native_scanner_lock.release()
+    scanner.lock.acquire()
+    try:
+        if targets is not None:
+            ip, netmask = scanner.getSubnet()
+            targets = getDiscovery(interface, ip, netmask).getTargets(targets)
+        scanner.rate, scanner.budget = _sweep_rate, _sweep_budget
+        result = scanner.scan(targets)
+        coverage, skipped = scanner.coverage, scanner.skipped
+    finally:
+        scanner.lock.release()
+    _native_scanner_lock.acquire()
+    try:
+        _sweep_results[interface] = (coverage, skipped)
+    finally:
+        _native_scanner_lock.release()
+    return result
+
+def takeSweepResults():
+    """:return: dict of interface -> (coverage, skipped addresses) of the built-in scans since the previous call."""
+    global _sweep_results
+    _native_scanner_lock.acquire()
+    try:
+        result = _sweep_results
+        _sweep_results = {}
     finally:
-        _tracked_devices_lock.release()
+        _native_scanner_lock.release()
+    return result
+
+def getDiscovery(key, ip, netmask):
+    """:return: the Discovery of an interface or subnet, called from the scan threads."""
+    _discovery_lock.acquire()
+    try:
+        item = _discoveries.get(key)
+        if not item:
+            item = _discoveries[key] = discovery.Discovery(_discovery_slice)
+    finally:
+        _discovery_lock.release()
+    item.setSubnet(ip, netmask)
+    return item
+
+def findArpScanTargets(command, timeout, targets):
+    """
+    performs a tracked-only scan with arp-scan: the addresses are passed in a temporary file.
+    :param targets: list of integer addresses of the tracked devices.
+    :return: dict of mac -> ip
+    """
+    key, ip, netmask = discovery.getArpScanNetwork(command)
+    addresses = getDiscovery(key, ip, netmask).getTargets(targets)
+    handle, path = tempfile.mkstemp(prefix='arpscanner-', suffix='.txt')
+    try:
+        os.write(handle, '\n'.join(socket.inet_ntoa(struct.pack('!I', address)) for address in addresses))
+        os.close(handle)
+        return scanCommand(discovery.getTargetCommand(command, path), timeout)
+    finally:
+        os.remove(path)
+
+def neighbourChanged(present, mac, ip):
+    """
+    called by the neighbour monitor when an entry in the kernel neighbour table changes.
+    Joins are reported right away, departures are handled by the regular update cycle.
+    """
+    if present:
+        onDeviceSeen(mac, ip)
+
+def findNeighbourDevices():
+    """
+    gets the devices from the kernel neighbour table. The monitor is started the first time.
+    :return: dict of mac -> ip
+    """
+    global _neighbour_monitor
+    if not _neighbour_monitor:
+        _neighbour_monitor = neighbours.NeighbourMonitor(neighbourChanged)
+        _neighbour_monitor.start()
+    return _neighbour_monitor.getDevices()
+
+def stop_neighbour_monitor():
+    """stops following the kernel neighbour table"""
+    global _neighbour_monitor
+    if _neighbour_monitor:
+        _neighbour_monitor.isRunning = False
+        _neighbour_monitor = None
+
+def scanCommand(command, timeout, targets = None):
+    """
+    performs a single scan.
+    :param command: the arp command to use.
+    :param timeout: the max nr of seconds that the scan can take.
+    :param targets: optional list of integer addresses of the tracked devices, for a tracked-only scan.
+    :return: dict of mac -> ip
+    """
+    if arpsweep.isNativeCommand(command):
+        return findNativeDevices(arpsweep.getInterface(command), targets)
+    if neighbours.isNeighbourCommand(command):
+        return findNeighbourDevices()
+    if targets is not None and parsers.getParser(command) == parsers.parseArpScan:
+        return findArpScanTargets(command, timeout, targets)
+    foundDevices = {}
+    timing = {} if _metrics else None
+    # Execute arp command to find all currently known devices, the output format is determined by the command.
+    for mac, ip in parsers.streamDevices(command, timeout, timing):
+        foundDevices[mac] = ip
+    if timing and _metrics:
+        _metrics.addParseTime(timing['parse'])
+    return foundDevices
+
+def scanNetwork(trackedIps = None):
+    """
+    scans the network: all the configured interfaces in parallel, or just the arp command.
+    A scan of an interface that takes longer than the refresh frequency doesn't hold up the others: it keeps
+    running and it's result is used in the next cycle.
+    :param trackedIps: optional list of the last known addresses of the tracked devices, for a tracked-only scan.
+    :return: (foundDevices, excluded, sweeps). excluded is None when all the interfaces were scanned, otherwise it's the
+             set of macs that were last seen on a failed or still running interface: they can't be judged in this cycle.
+             sweeps: dict of interface -> (coverage, skipped addresses) of the built-in scanner, see takeSweepResults.
+    """
+    targets = None
+    if trackedIps is not None:
+        targets = discovery.toAddresses(trackedIps)
+    if not _multi_scanner.isBusy():
+        takeSweepResults()                                                  # start clean, in case a previous scan failed.
+    if not _interfaces or neighbours.isNeighbourCommand(_arp_command):       # the kernel table covers all interfaces.
+        return scanCommand(_arp_command, _scan_timeout, targets), None, takeSweepResults()
+    jobs = [(interface, multiscan.getInterfaceCommand(_arp_command, interface), timeout) for interface, timeout in _interfaces]
+    foundDevices = {}
+    failed = set()
+    for interface, result in _multi_scanner.scan(lambda command, timeout: scanCommand(command, timeout, targets), jobs, _refresh_frequency):
+        if result is None or result is multiscan.PENDING:
+            failed.add(interface)
+            continue
+        for mac, ip in result.iteritems():
+            foundDevices[mac] = ip
+            _device_interfaces[mac] = interface
+    if not failed:
+        return foundDevices, None, takeSweepResults()
+    return foundDevices, set(mac for mac, interface in _device_interfaces.iteritems() if interface in failed), takeSweepResults()
+
+def findDevices():
+    """
+    Can be called from any thread: while a scan is running, it's result is shared instead of starting another one,
+    and a result that is less than _scan_ttl seconds old is reused.
+    :return: dict of mac -> ip for all the devices that were found on the network.
+    """
+    return _scan_service.scan(_scan_ttl, None)[0]
+
+
+def setPresent(mac, tracked, present):
+    """
+    changes the presence state of a tracked device and reports it to the cloud.
+    """
+    global _snapshot_dirty
+    _snapshot_dirty = True
+    if _event_log:
+        _event_log.append(time.time(), mac, tracked.ip, tracked.rtt, present)
+    tracked.present = present
+    tracked.changeCount = 0
+    _suspect_devices.discard(mac)
+    if _metrics:
+        _metrics.transition(present)
+    if present:
+        logger.info('joined: ' + tracked.name)
+        _present_devices.add(mac)
+    else:
+        logger.info('left: ' + tracked.name)
+        _present_devices.discard(mac)                  # the ip is kept: it's the first place to look for the device.
+    publishPresence(mac, tracked)
+
+def publishPresence(mac, tracked):
+    """queues the presence state of a device, it is retried with the next batch when the queue is full."""
+    if _publisher.publish('true' if tracked.present else 'false', tracked.name):
+        _unsent_presence.discard(mac)
+    else:
+        _unsent_presence.add(mac)
+
+def resendPresence():
+    """queues the current state of the devices whose presence didn't reach the cloud, we are the only authority."""
+    for mac in list(_unsent_presence):
+        tracked = _tracked_devices.get(mac)
+        if tracked:
+            publishPresence(mac, tracked)
+        else:
+            _unsent_presence.discard(mac)
+
+def updateAssetStates(current, probed = None):
+    """
+    updates the list. Only the differences with the local presence state are processed, so
+    the cost depends on the nr of changes, not on the nr of tracked devices.
+    :param current: The new state, that was just discovered: dict of mac -> ip, the macs as strings in any notation or as integers.
+    :param probed: optional set of macs (as integers) that were looked for. When specified, only these devices can be marked as missing.
+    :return:
+    """
+    current = _tracked_devices.match(current)
+    global _snapshot_dirty
+    if _tracked_devices.updateSeen(current, time.time()):  # store the ip addresses so we can ping them if need be
+        _snapshot_dirty = True
+    found = current.viewkeys()
+    for knownMac in found - _present_devices:
+        setPresent(knownMac, _tracked_devices[knownMac], True)
+    for knownMac in _suspect_devices & found:       # seen again, so it didn't leave.
+        _tracked_devices[knownMac].changeCount = 0
+    _suspect_devices.difference_update(found)
+    missing = _present_devices - found
+    if probed is not None:
+        missing &= probed
+    for knownMac in missing:
+        knownName = _tracked_devices[knownMac]
+        if _confirmer and _confirmer.confirm(knownMac, knownName):     # the confirmer decides, within a few probe rounds.
+            _suspect_devices.add(knownMac)
+            continue
+        knownName.changeCount += 1
+        if knownName.changeCount > _min_departure_count:  # compensate: the device has to disapear for 2 cycles before we really report it gone.
+            setPresent(knownMac, knownName, False)
+        else:
+            _suspect_devices.add(knownMac)
+    flushChanges()
+
+def flushChanges():
+    """the changes of this cycle go out as 1 batch."""
+    if _unsent_presence:
+        resendPresence()
+    _publisher.flush()
+    if _event_log:
+        _event_log.flush()
+
+def onDeviceSeen(mac, ip):
+    """
+    called by the passive listener (from it's own thread) for every device that sends arp or dhcp traffic.
+    The device is processed on the engine's loop.
+    """
+    _engine.call(deviceSeen, mac, ip)
+
+def deviceSeen(mac, ip):
+    """
+    Tracked devices are reported as joined right away, without waiting for the next scan. Runs on the engine's loop.
+    :param mac: the mac address of the device
+    :param ip: the ip address of the device, None if it doesn't have one yet.
+    :return: None
+    """
+    global _snapshot_dirty
+    tracked = _tracked_devices.get(mac)
+    if tracked:
+        tracked.lastSeen = time.time()
+        if ip and _tracked_devices.setIp(tracked, ip):
+            _snapshot_dirty = True
+        if not tracked.present:
+            setPresent(tracked.key, tracked, True)
+        else:
+            tracked.changeCount = 0                 # it's talking, so it's definitely still there.
+            _suspect_devices.discard(tracked.key)
+
+def startScan():
+    """starts a scan of the network on the engine's worker thread, so the loop stays responsive."""
+    global _scanning, _scan_started
+    if not _scanning:
+        _scanning = True
+        _scan_started = time.time()
+        trackedIps = None
+        if _scan_mode == discovery.TRACKED_MODE:
+            trackedIps = [tracked.ip for tracked in _tracked_devices.itervalues() if tracked.ip]
+        _engine.runInExecutor(_scan_service.scan, (0, trackedIps), scanDone)
+
+def scanDone(result, error):
+    """
+    processes the result of a scan and schedules the next one. Runs on the engine's loop.
+    :param result: the result of scanNetwork
+    :param error: the exception, if the scan failed.
+    """
+    global _scanning, _scan_timer, _scan_cycle
+    _scanning = False
+    _scan_cycle += 1
+    scanTime = time.time() - _scan_started
+    hosts = 0
+    coverage = 1.0
+    if not error:
+        foundDevices, excluded, sweeps = result
+        hosts = len(foundDevices)
+        coverage = min([item[0] for item in sweeps.itervalues()] or [1.0])
+        updateAssetStates(foundDevices, getProbed(excluded, sweeps))
+        if _scan_mode == discovery.TRACKED_MODE:
+            for mac, ip in foundDevices.iteritems():
+                _visible_devices[mac] = (ip, _scan_cycle)
+        elif _visible_devices:
+            _visible_devices.clear()
+        publishVisible(foundDevices)
+    elapsed = time.time() - _scan_started
+    overrun = elapsed >= _refresh_frequency
+    if not overrun:
+        _scan_timer = _engine.callLater(_refresh_frequency - elapsed, startScan)
+    else:
+        logger.error("arp-scan time overrun: scan took longer than refresh rate")
+        _scan_timer = _engine.callLater(0, startScan)
+    if _metrics:
+        _metrics.endCycle(scanTime, elapsed - scanTime, hosts, overrun, coverage)
+
+def getProbed(excluded, sweeps):
+    """
+    finds the tracked devices that a scan was able to look for: not the ones on a failed or still running interface
+    (or that were not seen on any interface yet), nor the ones whose address was skipped by a sweep that ran out of time.
+    :return: set of macs (as integers), or None when all the devices were looked for.
+    """
+    unprobed = set()
+    if excluded is not None:
+        unprobed.update(_tracked_devices.match(dict.fromkeys(excluded)))
+        for mac in _present_devices:                    # not seen on any interface yet, it may be on the one that wasn't scanned.
+            if registry.formatMac(mac) not in _device_interfaces:
+                unprobed.add(mac)
+    skipped = set()
+    for coverage, addresses in sweeps.itervalues():
+        skipped.update(addresses)
+    if skipped:
+        for mac in _present_devices:                    # only the present devices can go missing.
+            ip = _tracked_devices[mac].ip
+            if ip and struct.unpack('!I', socket.inet_aton(ip))[0] in skipped:
+                unprobed.add(mac)
+    if not unprobed:
+        return None
+    return _tracked_devices.viewkeys() - unprobed
+
+def getVisible():
+    """
+    a tracked-only scan only sees a slice of the network: the visible devices are collected over the cycles it
+    takes to cover the whole network.
+    :return: dict of mac -> ip of the devices that were seen during the last pass over the network.
+    """
+    passLength = max([item.getPassLength() for item in _discoveries.values()] or [1])
+    oldest = _scan_cycle - passLength
+    for mac in [mac for mac, (ip, cycle) in _visible_devices.iteritems() if cycle <= oldest]:
+        del _visible_devices[mac]
+    return dict((mac, ip) for mac, (ip, cycle) in _visible_devices.iteritems())
+
+def publishVisible(foundDevices):
+    """
+    sends the changes in the list of visible devices since the previous time it was sent, nothing when there are
+    none. The full list is sent the first time, and after a refresh or a failed send (_published_visible is None).
+    """
+    global _published_visible
+    if _scan_mode == discovery.TRACKED_MODE:
+        foundDevices = getVisible()
+    if _published_visible is None:
+        value = {'full': True, 'added': foundDevices, 'removed': []}
+    else:
+        added = dict((mac, ip) for mac, ip in foundDevices.iteritems() if _published_visible.get(mac) != ip)
+        removed = [mac for mac in _published_visible if mac not in foundDevices]
+        if not added and not removed:
+            return
+        value = {'full': False, 'added': added, 'removed': removed}
+    _published_visible = dict(foundDevices)
+    if _show_vendors:
+        value['added'] = dict((mac, {'ip': ip, 'vendor': _vendors.lookup(mac) if _vendors else None}) for mac, ip in value['added'].iteritems())
+    if not _publisher.publish(value, VISIBLE_DEV_ID, mergeVisible):
+        _published_visible = None                       # dropped: the next one has to be the full list.
+
+def publishFailed(assetId):
+    """called by the publisher (from it's thread) when a value could not be sent."""
+    if assetId == VISIBLE_DEV_ID:
+        _engine.call(resetVisible)
+    else:
+        _engine.call(presenceFailed, assetId)
+
+def presenceFailed(assetId):
+    """the state of a tracked device didn't reach the cloud: it's sent again with the next batch."""
+    tracked = _tracked_devices.get(assetId)
+    if tracked:
+        _unsent_presence.add(tracked.key)
+
+def resetVisible():
+    """the cloud may not have the last changes of the visible devices: the next publish sends the full list."""
+    global _published_visible
+    _published_visible = None
+
+def mergeVisible(queued, value):
+    """combines 2 changes of the visible devices that are waiting to be sent."""
+    if value['full']:
+        return value
+    added = dict((mac, ip) for mac, ip in queued['added'].iteritems() if mac not in value['removed'])
+    added.update(value['added'])
+    removed = set(queued['removed']).union(value['removed']).difference(value['added'])
+    if queued['full']:
+        removed = []                                    # the full list doesn't need removals.
+    return {'full': queued['full'], 'added': added, 'removed': list(removed)}
+
+def refreshVisible():
+    """
+    sends the full list of visible devices. A recent scan result is used right away, otherwise it's sent after the
+    next scan, which is started right away if none is running.
+    """
+    global _published_visible
+    _published_visible = None                           # the user asks for the list, not for the changes.
+    cached = _scan_service.getCached(_scan_ttl)
+    if cached:
+        publishVisible(cached[0])
+        return
+    if not _scanning:
+        if _scan_timer:
+            _scan_timer.cancel()
+        startScan()
+
+def configureMetrics(config):
+    """
+    turns the collection of the performance metrics on or off. Runs on the engine's loop.
+    :param config: (publish, path, interval) as returned by metrics.parseConfig, None to turn them off.
+    """
+    global _metrics, _metrics_config, _metrics_timer
+    _metrics_config = config
+    if _metrics_timer:
+        _metrics_timer.cancel()
+        _metrics_timer = None
+    if config:
+        if not _metrics:
+            _metrics = metrics.Metrics()
+            _engine.monitor = _metrics
+        _metrics_timer = _engine.callLater(config[2], reportMetrics)
+    else:
+        _metrics = None
+        _engine.monitor = None
+
+def reportMetrics():
+    """publishes and/or writes the performance metrics, then schedules the next report. Runs on the engine's loop."""
+    global _metrics_timer
+    publish, path, interval = _metrics_config
+    stats = _publisher.getStats()
+    pingStats = _pinger.scheduler.getStats() if _pinger else None
+    if publish:
+        _publisher.publish(_metrics.snapshot(stats, False, pingStats), METRICS_ID)
+    if path:                                            # formatting and writing the histograms of all devices is done off the loop.
+        _engine.runInExecutor(metrics.writeFile, (path, _metrics.snapshot(stats, True, pingStats)), metricsWritten)
+    _metrics_timer = _engine.callLater(interval, reportMetrics)
+
+def metricsWritten(result, error):
+    if error:
+        logger.error("failed to write the metrics file: %s", error)
+
+def loadSnapshot():
+    """reads the snapshot of the previous run, the tracked devices that are in it start from their last known state."""
+    global _warm_state
+    start = time.time()
+    _warm_state = snapshot.load(_snapshot_path)
+    if _warm_state:
+        logger.info("loaded the state of %s devices in %.3f seconds", len(_warm_state), time.time() - start)
+
+def devicesLoaded():
+    """
+    the tracked devices have been loaded: the snapshot is no longer needed, the periodic writes can start
+    and the changes can be logged.
+    """
+    global _warm_state, _snapshot_timer, _event_log
+    _warm_state = None
+    if not _snapshot_timer:
+        _snapshot_timer = _engine.callLater(_snapshot_interval, writeSnapshot)
+    if _event_log_dir and not _event_log:
+        _event_log = eventlog.EventLog(_event_log_dir, presentDevices)
+
+def presentDevices():
+    """:return: list of (mac, ip) of the tracked devices that are present."""
+    return [(mac, _tracked_devices[mac].ip) for mac in _present_devices]
+
+def writeSnapshot():
+    """
+    writes the snapshot if the presence or the address of a device changed since the last write, or when the
+    last write is too old. Runs on the engine's loop.
+    """
+    global _snapshot_dirty, _snapshot_timer, _snapshot_written
+    now = time.time()
+    if _snapshot_dirty or (_present_devices and now - _snapshot_written >= _snapshot_max_age):
+        _snapshot_dirty = False
+        _snapshot_written = now
+        _engine.runInExecutor(snapshot.write, (_snapshot_path, snapshot.pack(_tracked_devices.itervalues())), snapshotWritten)
+    _snapshot_timer = _engine.callLater(_snapshot_interval, writeSnapshot)
+
+def snapshotWritten(result, error):
+    global _snapshot_dirty
+    if error:
+        logger.error("failed to write the snapshot: %s", error)
+        _snapshot_dirty = True                          # try again next time.
+
+def saveSnapshot():
+    """writes the snapshot right away, when the plugin stops."""
+    if _tracked_devices:
+        try:
+            snapshot.write(_snapshot_path, snapshot.pack(_tracked_devices.itervalues()))
+        except (IOError, OSError):
+            logger.exception("failed to write the snapshot")
+
+def trackedChanged(list):
+    """the list of tracked devices was changed by the user. Runs on the engine's loop."""
+    syncAssets(list, _tracked_devices)              # the tracked devices represent the existing assets, cause they have already been loaded.
 
 def run():
     ''' optional
-        main function of the plugin module'''
-    start = datetime.datetime.now()
-    foundDevices = findDevices()
-    _device.send(foundDevices, VISIBLE_DEV_ID)      # init state for the visible devices.
-    while _isRunning:
-        try:
-            updateAssetStates(foundDevices)
-            refresh_every = datetime.timedelta(seconds=_refresh_frequency)
-            time_dif = (datetime.datetime.now() - start)
-            if time_dif < refresh_every:
-                time_dif = refresh_every - time_dif
-                _main_wake_up_event.wait(time_dif.total_seconds())  # wake up if the service stops.
-            else:
-                logger.error("arp-scan time overrun: scan took longer than refresh rate")
-            if _isRunning:
-                start = datetime.datetime.now()
-                foundDevices = findDevices()
-        except Exception as e:
-            logger.exception("failed to perform arp scan")
+        main function of the plugin module: runs the engine until stop is called.'''
+    _engine.call(startScan)
+    _engine.run()
+    setPinging(False)
+    setConfirming(False)
+    setVendors(False)
+    saveSnapshot()
+    if _event_log:
+        _event_log.close()
 
 
 def stop():
     """ optional
         called when the application is stopped. Perform all the necessary cleanup here"""
-    global _isRunning
     logger.info("stopping arp scanner")
-    _isRunning = False
-    _main_wake_up_event.set()
-    stop_ping()
+    _engine.stop()
+    stop_listener()
+    stop_neighbour_monitor()
+    _multi_scanner.close()
+    if _publisher:
+        _publisher.stop()
+
 
+def decodeValue(value):
+    """actuator values arrive as json text (true, "tracked"), plain text is returned as is."""
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return value
+
+def isTrue(value):
+    """:return: True when an actuator value turns a switch on, 'false' turns it off."""
+    value = decodeValue(value)
+    return value is True or (isinstance(value, basestring) and value.lower() == 'true')
 
 #callback: handles values sent from the cloudapp to the device
 def onActuate(id, value):
     if id == TRACKED_DEV_ID:
         list = json.loads(value)
-        _tracked_devices_lock.acquire()
-        try:
-            keys = _tracked_devices.keys()
-        finally:
-            _tracked_devices_lock.release()
-        syncAssets(list, keys)       # the keys represent the existing devices, cause they have already been loaded.
+        _engine.call(trackedChanged, list)
         _device.send(list, id)
     elif id == REFRESH_VISIBLE_DEV_ID:
-        foundDevices = findDevices()
-        _device.send(foundDevices, VISIBLE_DEV_ID)
+        _engine.call(refreshVisible)
     elif id == ARP_COMMAND_ID:
         global _arp_command
         _arp_command = value
+        if not neighbours.isNeighbourCommand(value):
+            stop_neighbour_monitor()
         _device.send(value, ARP_COMMAND_ID)
     elif id == USE_PING_ID:
-        if bool(value) == True:
+        if isTrue(value):
             start_ping()
         else:
             stop_ping()
+    elif id == SCAN_MODE_ID:
+        global _scan_mode
+        value = decodeValue(value)
+        if value in (discovery.FULL_MODE, discovery.TRACKED_MODE):
+            _scan_mode = value
+            _device.send(value, SCAN_MODE_ID)
+        else:
+            logger.error("unknown scan mode: %s", value)
+    elif id == CONFIRM_ID:
+        _engine.call(setConfirming, isTrue(value))
+    elif id == VENDORS_ID:
+        _engine.call(setVendors, isTrue(value))
+    elif id == PASSIVE_ID:
+        if isTrue(value):
+            start_listener()
+        else:
+            stop_listener()
+    elif id == INTERFACES_ID:
+        global _interfaces
+        _interfaces = multiscan.parseConfig(json.loads(value), _scan_timeout)
+        _device.send(value, INTERFACES_ID)
+    elif id == SWEEP_ID:
+        global _sweep_rate, _sweep_budget
+        _sweep_rate, _sweep_budget = arpsweep.parseSweepConfig(json.loads(value))
+        _device.send(value, SWEEP_ID)
+    elif id == DIAGNOSTICS_ID:
+        _engine.call(configureMetrics, metrics.parseConfig(json.loads(value)))
+        _device.send(value, DIAGNOSTICS_ID)
     elif id == MIN_DEPARTURE_CNT_ID:
         global _min_departure_count
         _min_departure_count = int(value)
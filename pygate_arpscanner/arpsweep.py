@@ -0,0 +1,269 @@
+"""
+    In-process arp scanner, used instead of forking 'sudo arp-scan' for every scan.
+
+    An arp who-has request is sent for every address in the subnet of the interface,
+    the replies are collected on a raw AF_PACKET socket. The socket is kept open
+    between scans, so a scan doesn't cost any process creation.
+
+    The sweep can be paced (a max nr of requests per second, so routers that rate limit arp don't drop replies)
+    and bounded in time (a budget per scan). Replies are read while the scanner waits for the next send slot.
+    When the budget runs out, the scan stops sending, and the next scan starts with the addresses it didn't get to.
+
+    Note: linux only, and the process needs root (or CAP_NET_RAW) rights.
+    The scanner can be tried out without a real lan by creating a veth pair:
+        ip link add veth0 type veth peer name veth1
+        ip addr add 10.9.9.1/24 dev veth0 && ip addr add 10.9.9.2/24 dev veth1
+        ip link set veth0 up && ip link set veth1 up
+    and scanning 'veth0'.
+"""
+
+import logging
+logger = logging.getLogger('arpscanner')
+import socket, struct, fcntl, select, time
+from threading import Lock
+
+NATIVE_COMMAND = 'native'           # value of the arp command asset that selects this scanner, optionally followed by the interface name.
+DEFAULT_INTERFACE = 'eth0'
+
+ETH_P_ARP = 0x0806
+ARP_REQUEST = 1
+ARP_REPLY = 2
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891b
+SIOCGIFHWADDR = 0x8927
+BROADCAST_MAC = '\xff' * 6
+
+
+def isNativeCommand(command):
+    """
+    checks if the arp command selects the built-in scanner.
+    :param command: the value of the arp command asset.
+    :return: True if the command is of the form 'native [interface]'
+    """
+    return bool(command) and command.split()[0] == NATIVE_COMMAND
+
+
+def getInterface(command):
+    """
+    extracts the interface name from the arp command ('native eth1' -> 'eth1')
+    :param command: the value of the arp command asset.
+    :return: the interface name, or the default interface if none was specified.
+    """
+    parts = command.split()
+    if len(parts) > 1:
+        return parts[1]
+    return DEFAULT_INTERFACE
+
+
+def formatMac(raw):
+    """converts 6 raw bytes into the 'aa:bb:cc:dd:ee:ff' notation used by arp-scan"""
+    return ':'.join('%02x' % ord(c) for c in raw)
+
+
+def _ioctl(sock, request, interface):
+    return fcntl.ioctl(sock.fileno(), request, struct.pack('256s', interface[:15]))
+
+
+def getInterfaceInfo(interface):
+    """
+    gets the addressing info of a network interface.
+    :param interface: the name of the interface
+    :return: a tuple (mac, ip, netmask): the mac as raw bytes, ip and netmask as integers.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        mac = _ioctl(sock, SIOCGIFHWADDR, interface)[18:24]
+        ip = struct.unpack('!I', _ioctl(sock, SIOCGIFADDR, interface)[20:24])[0]
+        netmask = struct.unpack('!I', _ioctl(sock, SIOCGIFNETMASK, interface)[20:24])[0]
+    finally:
+        sock.close()
+    return mac, ip, netmask
+
+
+def parseSweepConfig(value):
+    """
+    converts the value of the sweep config asset.
+    :param value: None (no limits) or an object with the optional fields 'rate' (max nr of arp requests per second)
+                  and 'budget' (max nr of seconds that a scan can take, including the wait for the replies).
+    :return: tuple (rate, budget), None for a limit that is not set.
+    """
+    if not value:
+        return None, None
+    rate = value.get('rate')
+    budget = value.get('budget')
+    return (float(rate) if rate else None), (float(budget) if budget else None)
+
+
+def subnetHosts(ip, netmask, maxHosts):
+    """
+    lists all the host addresses in the subnet of ip, excluding ip itself.
+    :param maxHosts: the max nr of addresses to return, to keep the scan of very large subnets bounded.
+    :return: a list of integer ip addresses.
+    """
+    network = ip & netmask
+    broadcast = network | (~netmask & 0xFFFFFFFF)
+    if broadcast - network < 2:                     # /31 or /32: nothing to scan.
+        return []
+    last = min(broadcast - 1, network + maxHosts)
+    if last < broadcast - 1:
+        logger.warning("subnet too large for native arp scan, only the first %s addresses are scanned", maxHosts)
+    return [host for host in xrange(network + 1, last + 1) if host != ip]
+
+
+class ArpScanner(object):
+    """
+    performs arp scans on 1 interface, over a raw socket that stays open between scans.
+    """
+    def __init__(self, interface, timeout=0.5, maxHosts=4096, rate=None, budget=None):
+        """
+        :param interface: the name of the network interface to scan.
+        :param timeout: the nr of seconds to wait for replies after the last request was sent.
+        :param maxHosts: the max nr of addresses that are scanned in the subnet.
+        :param rate: the max nr of requests per second, None to send as fast as the socket allows.
+        :param budget: the max nr of seconds that a scan can take (including the timeout), None for no limit.
+        """
+        self.interface = interface
+        self.timeout = timeout
+        self.maxHosts = maxHosts
+        self.rate = rate
+        self.budget = budget
+        self.coverage = 1.0                 # the fraction of the targets that the last scan asked for.
+        self.skipped = []                   # the targets that the last scan didn't get to (integers), the next scan starts with them.
+        self._socket = None
+        self._mac = None
+        self._ip = None
+        self._netmask = None
+        self.lock = Lock()                  # a scan can't be shared, callers that run in different threads have to take this lock.
+
+    def open(self):
+        """opens the raw socket and loads the addressing info of the interface."""
+        if not self._socket:
+            self._mac, self._ip, self._netmask = getInterfaceInfo(self.interface)
+            self._socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ARP))
+            self._socket.bind((self.interface, ETH_P_ARP))
+            self._socket.setblocking(0)
+
+    def close(self):
+        if self._socket:
+            self._socket.close()
+            self._socket = None
+
+    def getSubnet(self):
+        """:return: (ip, netmask) of the interface, as integers."""
+        self.open()
+        return self._ip, self._netmask
+
+    def fileno(self):
+        """the socket can be waited on with select, once the scanner is open."""
+        return self._socket.fileno()
+
+    def buildRequest(self, targetIp, targetMac=None):
+        """
+        builds the ethernet frame for an arp who-has request.
+        :param targetIp: the address to ask for, as an integer.
+        :param targetMac: optional, the raw mac of the device that is expected to have the address: the request is
+                          sent to this device only (unicast), instead of to the whole network.
+        :return: the raw frame
+        """
+        eth = (targetMac or BROADCAST_MAC) + self._mac + struct.pack('!H', ETH_P_ARP)
+        arp = struct.pack('!HHBBH6sI6sI', 1, 0x0800, 6, 4, ARP_REQUEST, self._mac, self._ip, targetMac or '\x00' * 6, targetIp)
+        return eth + arp
+
+    def send(self, targetIp, targetMac=None):
+        """
+        sends a single arp request, the replies can be collected with readReplies.
+        :param targetIp: the address to ask for, as an integer.
+        :param targetMac: optional raw mac, see buildRequest.
+        """
+        self.open()
+        self._socket.send(self.buildRequest(targetIp, targetMac))
+
+    def readReplies(self):
+        """:return: dict of mac -> ip of the arp replies that are currently available, doesn't block."""
+        found = {}
+        self._readReplies(found)
+        return found
+
+    def _drain(self):
+        """discard frames that arrived between scans, so they don't pollute the result."""
+        try:
+            while self._socket.recv(2048):
+                pass
+        except socket.error:
+            pass
+
+    def _readReplies(self, found):
+        """reads all the frames that are currently available and stores the arp replies in found."""
+        while True:
+            try:
+                frame = self._socket.recv(2048)
+            except socket.error:
+                return
+            if len(frame) < 42:
+                continue
+            oper, sha, spa = struct.unpack('!6xH6s4s', frame[14:32])
+            if oper == ARP_REPLY:
+                found[formatMac(sha)] = socket.inet_ntoa(spa)
+
+    def _wait(self, found, seconds):
+        """collects the replies that arrive within the given nr of seconds."""
+        deadline = time.time() + seconds
+        while True:
+            timeLeft = deadline - time.time()
+            if timeLeft <= 0:
+                break
+            if select.select([self._socket], [], [], timeLeft)[0]:
+                self._readReplies(found)
+
+    def _order(self, targets):
+        """:return: the targets, the ones that the previous scan didn't get to first."""
+        if not self.skipped:
+            return targets
+        wanted = set(targets)
+        first = [target for target in self.skipped if target in wanted]
+        if not first:
+            return targets
+        queued = set(first)
+        return first + [target for target in targets if target not in queued]
+
+    def scan(self, targets=None):
+        """
+        performs a single arp scan. When the budget runs out, the addresses that were not asked for are
+        stored in skipped, and coverage is lower than 1.
+        :param targets: optional list of integer ip addresses to scan. When None, the whole subnet is scanned.
+        :return: a dict of mac -> ip for all the devices that replied (same format as findDevices).
+        """
+        self.open()
+        if targets is None:
+            targets = subnetHosts(self._ip, self._netmask, self.maxHosts)
+        targets = self._order(targets)
+        found = {}
+        self._drain()
+        start = time.time()
+        stopAt = start + self.budget - self.timeout if self.budget else None       # leave time for the last replies.
+        interval = 1.0 / self.rate if self.rate else 0
+        nextSend = start
+        sent = 0
+        for target in targets:
+            if interval or stopAt:
+                now = time.time()
+                if stopAt and now >= stopAt and sent:      # at least 1 request, so a too small budget still makes progress.
+                    break
+                if nextSend > now:
+                    self._wait(found, nextSend - now)       # pipelined: the replies are read while waiting for the next slot.
+                elif nextSend < now - 0.05:
+                    nextSend = now                          # fell behind, don't burst to catch up.
+                nextSend += interval
+            try:
+                self._socket.send(self.buildRequest(target))
+            except socket.error:                            # send buffer full: collect what came in so far and retry once.
+                self._readReplies(found)
+                select.select([], [self._socket], [], self.timeout)
+                self._socket.send(self.buildRequest(target))
+            sent += 1
+        self.skipped = targets[sent:]
+        self.coverage = float(sent) / len(targets) if targets else 1.0
+        if self.skipped:
+            logger.info("arp sweep of %s out of time: %d of %d addresses done, the rest is resumed in the next scan", self.interface, sent, len(targets))
+        self._wait(found, self.timeout)
+        return found
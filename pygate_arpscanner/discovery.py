@@ -0,0 +1,119 @@
+"""
+    Tracked-only scanning: instead of the whole subnet, a scan only asks for the last known addresses of the
+    tracked devices, so it's cost depends on the nr of tracked devices instead of the size of the network.
+    The rest of the subnet is covered by a slow background discovery: every scan also includes the next slice of
+    the subnet, so tracked devices that changed address are found again, and the visible devices are still
+    reported, after enough cycles.
+"""
+
+import logging
+logger = logging.getLogger('arpscanner')
+import re, socket, struct
+
+import arpsweep
+
+TRACKED_MODE = 'tracked'            # value of the scan mode asset that selects tracked-only scanning.
+FULL_MODE = 'full'
+
+_subnet_re = re.compile(r'^(\d{1,3}(\.\d{1,3}){3})/(\d{1,2})$')
+
+
+def parseSubnet(value):
+    """
+    :param value: a subnet in cidr notation, ex: 192.168.2.0/24
+    :return: (ip, netmask) as integers, or None if the value is not a subnet.
+    """
+    match = _subnet_re.match(value)
+    if not match:
+        return None
+    bits = int(match.group(3))
+    return struct.unpack('!I', socket.inet_aton(match.group(1)))[0], (0xFFFFFFFF << (32 - bits)) & 0xFFFFFFFF
+
+
+def toAddresses(ips):
+    """converts a list of ip addresses to integers."""
+    return [struct.unpack('!I', socket.inet_aton(ip))[0] for ip in ips]
+
+
+def getArpScanInterface(command):
+    """:return: the interface of an arp-scan command (-I or --interface=), the default interface if it has none."""
+    parts = command.split()
+    for index, part in enumerate(parts):
+        if part == '-I' and index + 1 < len(parts):
+            return parts[index + 1]
+        elif part.startswith('--interface='):
+            return part.split('=', 1)[1]
+    return arpsweep.DEFAULT_INTERFACE
+
+
+def getArpScanNetwork(command):
+    """
+    finds the network that an arp-scan command scans.
+    :return: (key, ip, netmask): key is the subnet or interface name, ip and netmask are integers.
+    """
+    for part in command.split():
+        subnet = parseSubnet(part)
+        if subnet:
+            return (part,) + subnet
+    interface = getArpScanInterface(command)
+    mac, ip, netmask = arpsweep.getInterfaceInfo(interface)
+    return interface, ip, netmask
+
+
+def getTargetCommand(command, path):
+    """
+    converts an arp-scan command so that it only scans the addresses in a file, instead of the local network or a subnet.
+    :param path: the file with the addresses, 1 per line.
+    """
+    parts = [part for part in command.split() if part not in ('-l', '--localnet') and not parseSubnet(part)]
+    return ' '.join(parts + ['--file=' + path])
+
+
+class Discovery(object):
+    """
+    walks through the addresses of a subnet in slices, 1 slice per scan cycle, and starts over when the end is reached.
+    """
+    def __init__(self, sliceSize=256):
+        """
+        :param sliceSize: the nr of addresses that are added to every scan.
+        """
+        self.sliceSize = sliceSize
+        self._ip = None
+        self._netmask = 0
+        self._first = 0
+        self._count = 0
+        self._cursor = 0
+
+    def setSubnet(self, ip, netmask):
+        """sets the subnet to walk through, the walk starts over when it changes."""
+        network = ip & netmask
+        broadcast = network | (~netmask & 0xFFFFFFFF)
+        first, count = network + 1, max(broadcast - network - 1, 0)
+        if (ip, netmask) != (self._ip, self._netmask):
+            self._ip, self._netmask, self._first, self._count = ip, netmask, first, count
+            self._cursor = 0
+
+    def getPassLength(self):
+        """:return: the nr of scan cycles it takes to cover the whole subnet."""
+        return (self._count + self.sliceSize - 1) // self.sliceSize
+
+    def nextSlice(self):
+        """:return: the next addresses to discover, as integers."""
+        if not self._count:
+            return []
+        end = min(self._cursor + self.sliceSize, self._count)
+        result = [address for address in xrange(self._first + self._cursor, self._first + end) if address != self._ip]
+        self._cursor = end
+        if self._cursor >= self._count:
+            self._cursor = 0
+        return result
+
+    def getTargets(self, tracked):
+        """
+        :param tracked: the last known addresses of the tracked devices, as integers.
+        :return: sorted list of the addresses to scan: the tracked ones in the subnet + the next slice.
+        """
+        network = (self._ip or 0) & self._netmask
+        targets = set(address for address in tracked if address & self._netmask == network and address != self._ip)
+        targets.update(self.nextSlice())
+        return sorted(targets)
@@ -0,0 +1,175 @@
+"""
+    Single threaded event loop that drives the plugin: timers, non-blocking sockets and calls
+    that are posted from other threads all run on the loop's thread, one after the other.
+    Because all the state is only touched from this thread, it doesn't need to be locked.
+    Work that can block (an external scan command) is run on a worker thread and
+    it's result is delivered back on the loop.
+"""
+
+import logging
+logger = logging.getLogger('arpscanner')
+import heapq, itertools, select, socket, time
+from collections import deque
+from threading import Lock
+from multiprocessing.pool import ThreadPool
+
+
+class Timer(object):
+    """handle for a call that was scheduled with callLater, can be cancelled."""
+    def __init__(self, when, func, args):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.active = True
+
+    def cancel(self):
+        self.active = False
+
+
+class Engine(object):
+    """
+    the event loop. run() blocks until stop() is called.
+    """
+    def __init__(self, workers=1):
+        """
+        :param workers: the nr of threads that run the blocking work (see runInExecutor).
+        """
+        self.isRunning = False
+        self._workers = workers
+        self._executor = None
+        self._timers = []                               # heap of (when, seq, Timer)
+        self._seq = itertools.count()
+        self._readers = {}                              # socket -> callback
+        self._calls = deque()                           # (func, args, time posted) posted from other threads.
+        self._callsLock = Lock()
+        self._wakeup = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)     # sending a datagram to ourselves interrupts the select (works on windows too, unlike a pipe).
+        self._wakeup.bind(('127.0.0.1', 0))
+        self._wakeup.setblocking(0)
+        self._stopped = False
+        self.monitor = None                             # optional object with a method loopTask(wait, hold), called for every task that is run.
+
+    def _wake(self):
+        try:
+            self._wakeup.sendto('x', self._wakeup.getsockname())
+        except socket.error:
+            pass                                        # buffer full: the loop will wake up anyway.
+
+    def call(self, func, *args):
+        """
+        runs func(*args) on the loop's thread, as soon as possible. Can be called from any thread.
+        Calls that are made before the loop runs are executed when it starts.
+        """
+        self._callsLock.acquire()
+        try:
+            self._calls.append((func, args, time.time()))
+        finally:
+            self._callsLock.release()
+        self._wake()
+
+    def callLater(self, delay, func, *args):
+        """
+        runs func(*args) on the loop after delay seconds. Can only be used from the loop's thread (or before it starts).
+        :return: a Timer object that can be used to cancel the call.
+        """
+        timer = Timer(time.time() + delay, func, args)
+        heapq.heappush(self._timers, (timer.when, next(self._seq), timer))
+        return timer
+
+    def addReader(self, sock, callback):
+        """calls callback() on the loop whenever the socket has data available."""
+        self._readers[sock] = callback
+
+    def removeReader(self, sock):
+        self._readers.pop(sock, None)
+
+    def runInExecutor(self, func, args, onDone):
+        """
+        runs func(*args) on a worker thread. When it's done, onDone(result, error) is called on the loop,
+        error is the exception, if any.
+        """
+        if not self._executor:
+            self._executor = ThreadPool(self._workers)
+
+        def work():
+            try:
+                return func(*args), None
+            except Exception as e:
+                logger.exception("background work failed")
+                return None, e
+        self._executor.apply_async(work, callback=lambda result: self.call(onDone, *result))
+
+    def _runCalls(self):
+        self._callsLock.acquire()
+        try:
+            calls = self._calls
+            self._calls = deque()
+        finally:
+            self._callsLock.release()
+        for func, args, posted in calls:
+            if not self.isRunning:
+                return
+            self._execute(func, args, posted)
+
+    def _runTimers(self):
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now and self.isRunning:
+            timer = heapq.heappop(self._timers)[2]
+            if timer.active:
+                self._execute(timer.func, timer.args, timer.when)
+
+    def _execute(self, func, args, due):
+        """
+        runs a task.
+        :param due: the time at which the task could have run, to measure how long it waited.
+        """
+        monitor = self.monitor
+        if monitor:
+            start = time.time()
+        try:
+            func(*args)
+        except Exception:
+            logger.exception("engine task failed")
+        if monitor:
+            end = time.time()
+            monitor.loopTask(max(start - due, 0), end - start)
+
+    def _timeout(self):
+        while self._timers and not self._timers[0][2].active:
+            heapq.heappop(self._timers)
+        if self._timers:
+            return max(self._timers[0][0] - time.time(), 0)
+        return None
+
+    def run(self):
+        """runs the loop until stop is called."""
+        if self._stopped:
+            return
+        self.isRunning = True
+        try:
+            while self.isRunning:
+                self._runCalls()
+                self._runTimers()
+                if not self.isRunning:
+                    break
+                readers = self._readers.keys()
+                ready = select.select(readers + [self._wakeup], [], [], self._timeout())[0]
+                for sock in ready:
+                    if sock is self._wakeup:
+                        try:
+                            while self._wakeup.recv(64):
+                                pass
+                        except socket.error:
+                            pass
+                    elif sock in self._readers and self.isRunning:
+                        self._execute(self._readers[sock], (), time.time())
+        finally:
+            self.isRunning = False
+            if self._executor:
+                self._executor.terminate()
+                self._executor = None
+
+    def stop(self):
+        """stops the loop right away, pending timers and calls are discarded. Can be called from any thread."""
+        self._stopped = True
+        self.isRunning = False
+        self._wake()
@@ -0,0 +1,193 @@
+"""
+    Append-only log of the presence changes (joins and departures), for occupancy analytics without the cloud.
+    Every event is a fixed size binary record (time, mac, ip, ping round trip time, kind), appended to the current
+    segment file. When a segment is full, a new one is started, which begins with a record for every device that is
+    present at that moment: a query only has to read the segments that overlap with it's time window.
+    The oldest segments are deleted, so the log never takes more than maxSegments * segmentSize bytes.
+
+    The query functions memory map the segments and find the start of a time window by bisection, ex:
+        python -c "import time, eventlog; print eventlog.presentAt('events', time.time() - 3600)"
+"""
+
+import logging
+logger = logging.getLogger('arpscanner')
+import os, bisect, math, mmap, socket, struct
+from collections import namedtuple
+
+LEAVE = 0
+JOIN = 1
+STATE = 2                           # the device was present when the segment was started.
+
+_record = struct.Struct('<dQ4sfB7x')                    # time, mac (as integer), ip (0.0.0.0 = unknown), rtt in seconds (nan = unknown), kind
+RECORD_SIZE = _record.size
+_time = struct.Struct('<d')
+_no_ip = '\x00' * 4
+_prefix = 'events-'
+_suffix = '.seg'
+
+Event = namedtuple('Event', 'time mac ip rtt kind')
+
+
+class EventLog(object):
+    """writes the events to the segment files. Not thread safe: it is only used from the engine's loop."""
+    def __init__(self, directory, getPresent, segmentSize=1024 * 1024, maxSegments=64):
+        """
+        :param directory: the directory that contains the segments, it is created if needed.
+        :param getPresent: function without arguments that returns the (mac, ip) of the devices that are present,
+                           it is called when a segment is started.
+        :param segmentSize: the size at which a new segment is started, in bytes. A segment always has room for at least
+                            as many events as it has STATE records.
+        :param maxSegments: the nr of segments that are kept.
+        """
+        self.directory = directory
+        self.getPresent = getPresent
+        self.maxRecords = max(segmentSize // RECORD_SIZE, 1)
+        self.maxSegments = maxSegments
+        self._file = None
+        self._records = 0
+        self._limit = self.maxRecords
+
+    def append(self, when, mac, ip, rtt, present):
+        """
+        adds an event. The record is buffered, call flush to write it to the file.
+        :param when: the time of the event.
+        :param mac: the mac of the device, as integer.
+        :param ip: the ip address of the device, or None.
+        :param rtt: the last ping round trip time of the device in seconds, or None.
+        :param present: True for a join, False for a departure.
+        """
+        if not self._file or self._records >= self._limit:
+            self._startSegment(when)
+        self._file.write(_record.pack(when, mac, socket.inet_aton(ip) if ip else _no_ip,
+                                      rtt if rtt is not None else float('nan'), JOIN if present else LEAVE))
+        self._records += 1
+
+    def flush(self):
+        if self._file:
+            self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _startSegment(self, when):
+        self.close()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = os.path.join(self.directory, '%s%015.4f%s' % (_prefix, when, _suffix))
+        self._file = open(path, 'ab')
+        self._records = 0
+        for mac, ip in self.getPresent():
+            self._file.write(_record.pack(when, mac, socket.inet_aton(ip) if ip else _no_ip, float('nan'), STATE))
+            self._records += 1
+        self._limit = max(self.maxRecords, 2 * self._records)
+        for start, old in listSegments(self.directory)[:-self.maxSegments]:
+            try:
+                os.remove(old)
+            except OSError:
+                logger.exception("failed to remove event segment %s", old)
+
+
+def listSegments(directory):
+    """:return: sorted list of (start time, path) of the segments in the directory."""
+    result = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith(_prefix) and name.endswith(_suffix):
+                try:
+                    result.append((float(name[len(_prefix):-len(_suffix)]), os.path.join(directory, name)))
+                except ValueError:
+                    continue
+    result.sort()
+    return result
+
+
+class _Times(object):
+    """the timestamps of the records in a mapped segment, as a sequence, so bisect can search them."""
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data) // RECORD_SIZE
+
+    def __getitem__(self, index):
+        return _time.unpack_from(self.data, index * RECORD_SIZE)[0]
+
+
+def _toEvent(values):
+    when, mac, ip, rtt, kind = values
+    return Event(when, mac, socket.inet_ntoa(ip) if ip != _no_ip else None, None if math.isnan(rtt) else rtt, kind)
+
+
+def readSegment(path, start=None, end=None):
+    """
+    reads the events of a segment.
+    :param start: optional, the events before this time are skipped.
+    :param end: optional, reading stops at the first event after this time.
+    :return: generator of Event tuples.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size - os.fstat(f.fileno()).st_size % RECORD_SIZE     # a crash can leave a partial record.
+        if not size:
+            return
+        data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+    try:
+        index = 0
+        if start is not None:
+            index = bisect.bisect_left(_Times(data), start)
+        for offset in xrange(index * RECORD_SIZE, size, RECORD_SIZE):
+            values = _record.unpack_from(data, offset)
+            if end is not None and values[0] > end:
+                break
+            yield _toEvent(values)
+    finally:
+        data.close()
+
+
+def readEvents(directory, start=None, end=None, withState=False):
+    """
+    reads the events of a time window, over all the segments.
+    :param withState: when True, the reading starts at the beginning of the segment that contains start, including it's
+                      STATE records, so the presence at start can be reconstructed.
+    :return: generator of Event tuples.
+    """
+    segments = listSegments(directory)
+    first = 0
+    if start is not None:
+        first = max(bisect.bisect_right([begin for begin, path in segments], start) - 1, 0)
+    for begin, path in segments[first:]:
+        if end is not None and begin > end:
+            break
+        for event in readSegment(path, None if withState else start, end):
+            yield event
+
+
+def presentAt(directory, when):
+    """:return: dict of mac (as integer) -> ip of the devices that were present at the given time."""
+    present = {}
+    for event in readEvents(directory, when, when, True):
+        if event.kind == LEAVE:
+            present.pop(event.mac, None)
+        else:
+            present[event.mac] = event.ip
+    return present
+
+
+def dwellTimes(directory, start, end):
+    """
+    calculates how long every device was present in a time window.
+    :return: dict of mac (as integer) -> nr of seconds present between start and end.
+    """
+    since = {}                                  # mac -> time from which the device is present
+    result = {}
+    for event in readEvents(directory, start, end, True):
+        if event.kind == LEAVE:
+            joined = since.pop(event.mac, None)
+            if joined is not None and event.time > start:
+                result[event.mac] = result.get(event.mac, 0.0) + event.time - max(joined, start)
+        elif event.mac not in since:
+            since[event.mac] = event.time
+    for mac, joined in since.iteritems():
+        result[mac] = result.get(mac, 0.0) + end - max(joined, start)
+    return result
@@ -0,0 +1,164 @@
+"""
+    Passive presence detection: listens on an interface for the arp and dhcp traffic
+    that devices generate by themselves when they (re)connect to the network
+    (gratuitous arp, arp requests/replies, dhcp discover/request).
+    Every frame that is seen is reported through a callback, so a join can be
+    detected as soon as the device talks, without waiting for the next scan.
+
+    Note: linux only, and the process needs root (or CAP_NET_RAW) rights.
+"""
+
+import logging
+logger = logging.getLogger('arpscanner')
+import socket, struct, select, ctypes
+from threading import Thread
+
+import arpsweep
+
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+SO_ATTACH_FILTER = 26
+DHCP_SERVER_PORT = 67
+BOOTREQUEST = 1
+DHCP_MAGIC_COOKIE = '\x63\x82\x53\x63'
+DHCP_OPTION_REQUESTED_IP = 50
+DHCP_OPTION_END = 255
+
+# classic bpf program that only lets arp frames and udp packets to port 67 (dhcp requests) through,
+# so the kernel drops all other traffic before it reaches python.
+_FILTER = [
+    (0x28, 0, 0, 12),                       # ldh [12]               ethertype
+    (0x15, 8, 0, arpsweep.ETH_P_ARP),       # jeq arp                -> accept
+    (0x15, 0, 8, ETH_P_IP),                 # jeq ip, else           -> drop
+    (0x30, 0, 0, 23),                       # ldb [23]               ip protocol
+    (0x15, 0, 6, socket.IPPROTO_UDP),       # jeq udp, else          -> drop
+    (0x28, 0, 0, 20),                       # ldh [20]               fragment offset
+    (0x45, 4, 0, 0x1fff),                   # jset 0x1fff            -> drop
+    (0xb1, 0, 0, 14),                       # ldxb 4*([14]&0xf)      ip header length
+    (0x48, 0, 0, 16),                       # ldh [x+16]             udp destination port
+    (0x15, 0, 1, DHCP_SERVER_PORT),         # jeq 67, else           -> drop
+    (0x06, 0, 0, 0xffff),                   # accept
+    (0x06, 0, 0, 0),                        # drop
+]
+
+
+class _SockFilter(ctypes.Structure):
+    _fields_ = [('code', ctypes.c_uint16), ('jt', ctypes.c_uint8), ('jf', ctypes.c_uint8), ('k', ctypes.c_uint32)]
+
+
+class _SockFprog(ctypes.Structure):
+    _fields_ = [('len', ctypes.c_uint16), ('filter', ctypes.POINTER(_SockFilter))]
+
+
+def attachFilter(sock, program):
+    """
+    attaches a classic bpf program to the socket.
+    :param program: list of (code, jt, jf, k) tuples
+    """
+    instructions = (_SockFilter * len(program))(*[_SockFilter(*ins) for ins in program])
+    fprog = _SockFprog(len(program), instructions)
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, buffer(fprog)[:])
+
+
+def parseArp(frame):
+    """
+    extracts the sender of an arp frame (request, reply or gratuitous)
+    :return: (mac, ip), ip is None for arp probes (sender address 0.0.0.0). None if the frame can't be parsed
+    """
+    if len(frame) < 42:
+        return None
+    sha, spa = struct.unpack('!6s4s', frame[22:32])
+    ip = socket.inet_ntoa(spa)
+    if ip == '0.0.0.0':
+        ip = None
+    return arpsweep.formatMac(sha), ip
+
+
+def parseDhcp(frame):
+    """
+    extracts the client of a dhcp request.
+    :return: (mac, ip), ip is the client address or the requested address, if any. None if the packet is not a dhcp request
+    """
+    ipHeaderLen = (ord(frame[14]) & 0x0F) * 4
+    bootp = 14 + ipHeaderLen + 8
+    if len(frame) < bootp + 240 or ord(frame[bootp]) != BOOTREQUEST:
+        return None
+    mac = arpsweep.formatMac(frame[bootp + 28:bootp + 34])
+    ciaddr = frame[bootp + 12:bootp + 16]
+    if ciaddr != '\x00' * 4:
+        return mac, socket.inet_ntoa(ciaddr)
+    if frame[bootp + 236:bootp + 240] == DHCP_MAGIC_COOKIE:
+        pos = bootp + 240
+        while pos + 1 < len(frame):
+            option = ord(frame[pos])
+            if option == DHCP_OPTION_END:
+                break
+            if option == 0:                             # padding
+                pos += 1
+                continue
+            length = ord(frame[pos + 1])
+            if option == DHCP_OPTION_REQUESTED_IP and length == 4:
+                return mac, socket.inet_ntoa(frame[pos + 2:pos + 6])
+            pos += 2 + length
+    return mac, None
+
+
+def parseFrame(frame):
+    """
+    :return: (mac, ip) of the device that sent the frame, or None if it's not an arp or dhcp request frame.
+    """
+    if len(frame) < 14:
+        return None
+    ethertype = struct.unpack('!H', frame[12:14])[0]
+    if ethertype == arpsweep.ETH_P_ARP:
+        return parseArp(frame)
+    if ethertype == ETH_P_IP and len(frame) >= 34 and ord(frame[23]) == socket.IPPROTO_UDP:
+        return parseDhcp(frame)
+    return None
+
+
+class PassiveListener(Thread):
+    """
+    listens for arp and dhcp traffic on an interface and reports every device that is seen.
+    """
+    def __init__(self, interface, onSeen):
+        """
+        :param interface: the name of the interface to listen on.
+        :param onSeen: callback, called with (mac, ip) for every device that sends an arp or dhcp request frame. ip can be None
+        """
+        Thread.__init__(self)
+        self.daemon = True
+        self.isRunning = True
+        self.interface = interface
+        self.onSeen = onSeen
+
+    def _open(self):
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            attachFilter(sock, _FILTER)
+        except socket.error:
+            logger.warning("failed to attach packet filter, all traffic will be inspected")
+        sock.bind((self.interface, ETH_P_ALL))
+        return sock
+
+    def run(self):
+        try:
+            sock = self._open()
+        except:
+            logger.exception("failed to start passive listener on " + self.interface)
+            return
+        try:
+            while self.isRunning:
+                if not select.select([sock], [], [], 1)[0]:       # wake up regularly, so we can stop.
+                    continue
+                frame, address = sock.recvfrom(2048)
+                if address[2] == socket.PACKET_OUTGOING:            # our own requests (scans, pings), not a device.
+                    continue
+                try:
+                    seen = parseFrame(frame)
+                    if seen:
+                        self.onSeen(*seen)
+                except:
+                    logger.exception("passive listener failed to process frame")
+        finally:
+            sock.close()
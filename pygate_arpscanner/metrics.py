@@ -0,0 +1,273 @@
+"""
+    Performance metrics of the scan cycles, so the refresh frequency of a site can be sized on measurements.
+    Collected only when diagnostics are turned on: when off, the plugin keeps no metrics object and every
+    hook is a single 'if' on None.
+    The metrics can be published as an asset and/or written to a local file, in the prometheus text format
+    or as json (when the file name ends with .json).
+"""
+
+import logging
+logger = logging.getLogger('arpscanner')
+import os, json, time
+from threading import Lock
+
+import registry
+
+RTT_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5)        # upper bounds of the ping round trip time histogram, in seconds.
+DEFAULT_INTERVAL = 60                   # nr of seconds between 2 reports.
+
+
+def parseConfig(value):
+    """
+    converts the value of the metrics config asset.
+    :param value: None/False (off), True (publish as asset) or an object with the fields 'publish' (bool),
+                  'file' (path of the local file) and 'interval' (seconds between reports).
+    :return: tuple (publish, path, interval), or None when the metrics are turned off.
+    """
+    if not value:
+        return None
+    if isinstance(value, dict):
+        publish = bool(value.get('publish', False))
+        path = value.get('file') or None
+        interval = float(value.get('interval', DEFAULT_INTERVAL))
+    else:
+        publish, path, interval = True, None, DEFAULT_INTERVAL
+    if not publish and not path:
+        return None
+    return publish, path, interval
+
+
+class Summary(object):
+    """count, sum, max and last value of a measurement."""
+    __slots__ = ('count', 'sum', 'max', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.last = value
+        if value > self.max:
+            self.max = value
+
+    def toDict(self):
+        return {'count': self.count, 'sum': self.sum, 'max': self.max, 'last': self.last}
+
+
+class Histogram(object):
+    """ping round trip times of 1 device, the last count is for the replies slower than the last bucket."""
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(RTT_BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = 0
+        for bound in RTT_BUCKETS:
+            if value <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+
+
+class Metrics(object):
+    """
+    the metrics of the plugin. Only used from the engine's loop, except for addParseTime, which is called
+    from the scan threads.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.cycles = 0
+        self.overruns = 0
+        self.joins = 0
+        self.departures = 0
+        self.hosts = 0                      # nr of hosts seen in the last scan.
+        self.transitions = 0                # nr of joins + departures in the last scan cycle.
+        self._transitionsAtCycle = 0
+        self.coverage = 1.0                 # the fraction of the addresses that the last sweep asked for, lower when it ran out of time.
+        self.partialSweeps = 0              # nr of cycles in which the sweep ran out of time.
+        self.scan = Summary()               # wall time of the scans.
+        self.parse = Summary()              # time spent parsing the output of the arp command, per scan.
+        self.update = Summary()             # time spent processing a scan result.
+        self.loopWait = Summary()           # time that a task on the engine's loop waited before it could run.
+        self.loopHold = Summary()           # time that a task held the engine's loop.
+        self.rtt = {}                       # mac (as integer) -> Histogram
+        self._parseTime = 0.0
+        self._parseLock = Lock()
+
+    def addParseTime(self, seconds):
+        """adds the parse time of a scan command, can be called from any thread."""
+        self._parseLock.acquire()
+        try:
+            self._parseTime += seconds
+        finally:
+            self._parseLock.release()
+
+    def transition(self, present):
+        if present:
+            self.joins += 1
+        else:
+            self.departures += 1
+
+    def loopTask(self, wait, hold):
+        """called by the engine for every task that it runs."""
+        self.loopWait.observe(wait)
+        self.loopHold.observe(hold)
+
+    def observeRtt(self, mac, delay):
+        histogram = self.rtt.get(mac)
+        if not histogram:
+            histogram = self.rtt[mac] = Histogram()
+        histogram.observe(delay)
+
+    def endCycle(self, scanTime, updateTime, hosts, overrun, coverage=1.0):
+        """
+        records the measurements of a scan cycle.
+        :param coverage: the fraction of the addresses of the cycle that were asked for by the sweep.
+        """
+        self._parseLock.acquire()
+        try:
+            parseTime = self._parseTime
+            self._parseTime = 0.0
+        finally:
+            self._parseLock.release()
+        total = self.joins + self.departures
+        self.transitions = total - self._transitionsAtCycle
+        self._transitionsAtCycle = total
+        self.cycles += 1
+        self.hosts = hosts
+        self.scan.observe(scanTime)
+        self.parse.observe(parseTime)
+        self.update.observe(updateTime)
+        if overrun:
+            self.overruns += 1
+        self.coverage = coverage
+        if coverage < 1.0:
+            self.partialSweeps += 1
+
+    def snapshot(self, publishStats=None, devices=True, pingStats=None):
+        """
+        :param publishStats: the stats of the publisher.
+        :param devices: when True, the rtt histograms of the individual devices are included, otherwise only their total.
+        :param pingStats: the stats of the ping scheduler, when pinging is on.
+        :return: dict with all the metrics, can be converted to json.
+        """
+        result = {'uptime': time.time() - self.started, 'cycles': self.cycles, 'overruns': self.overruns,
+                  'joins': self.joins, 'departures': self.departures, 'hosts': self.hosts, 'transitions': self.transitions,
+                  'coverage': self.coverage, 'partial_sweeps': self.partialSweeps,
+                  'scan_seconds': self.scan.toDict(), 'parse_seconds': self.parse.toDict(), 'update_seconds': self.update.toDict(),
+                  'loop_wait_seconds': self.loopWait.toDict(), 'loop_hold_seconds': self.loopHold.toDict(),
+                  'rtt_buckets': list(RTT_BUCKETS)}
+        if publishStats:
+            result['publish'] = publishStats
+        if pingStats:
+            result['ping'] = pingStats
+        total = Histogram()
+        perDevice = {}
+        for mac, histogram in self.rtt.iteritems():
+            total.counts = [a + b for a, b in zip(total.counts, histogram.counts)]
+            total.sum += histogram.sum
+            if devices:
+                perDevice[registry.formatMac(mac)] = {'counts': list(histogram.counts), 'sum': histogram.sum}
+        result['rtt'] = {'counts': total.counts, 'sum': total.sum}
+        if devices:
+            result['rtt_devices'] = perDevice
+        return result
+
+
+def _summaryLines(lines, name, summary, help):
+    """a summary family with the sum and count, the max and last value are separate gauges (ex: scan_max_seconds)."""
+    lines.append('# HELP arpscanner_%s %s' % (name, help))
+    lines.append('# TYPE arpscanner_%s summary' % name)
+    lines.append('arpscanner_%s_sum %r' % (name, summary['sum']))
+    lines.append('arpscanner_%s_count %d' % (name, summary['count']))
+    base = name[:-len('_seconds')]
+    for key in ('max', 'last'):
+        lines.append('# HELP arpscanner_%s_%s_seconds %s: the %s value' % (base, key, help, key))
+        lines.append('# TYPE arpscanner_%s_%s_seconds gauge' % (base, key))
+        lines.append('arpscanner_%s_%s_seconds %r' % (base, key, summary[key]))
+
+
+def _histogramLines(lines, labels, histogram):
+    cumulative = 0
+    for bound, count in zip(RTT_BUCKETS, histogram['counts']):
+        cumulative += count
+        lines.append('arpscanner_ping_rtt_seconds_bucket{%sle="%r"} %d' % (labels, bound, cumulative))
+    cumulative += histogram['counts'][-1]
+    lines.append('arpscanner_ping_rtt_seconds_bucket{%sle="+Inf"} %d' % (labels, cumulative))
+    selector = '{%s}' % labels.rstrip(',') if labels else ''
+    lines.append('arpscanner_ping_rtt_seconds_sum%s %r' % (selector, histogram['sum']))
+    lines.append('arpscanner_ping_rtt_seconds_count%s %d' % (selector, cumulative))
+
+
+def toPrometheus(snapshot):
+    """:return: the snapshot in the prometheus text exposition format."""
+    lines = []
+    for name, key, kind, help in (('cycles_total', 'cycles', 'counter', 'nr of scan cycles'),
+                                  ('overruns_total', 'overruns', 'counter', 'nr of scans that took longer than the refresh frequency'),
+                                  ('joins_total', 'joins', 'counter', 'nr of devices that joined'),
+                                  ('departures_total', 'departures', 'counter', 'nr of devices that left'),
+                                  ('hosts_seen', 'hosts', 'gauge', 'nr of hosts seen in the last scan'),
+                                  ('cycle_transitions', 'transitions', 'gauge', 'nr of joins and departures in the last scan cycle'),
+                                  ('sweep_coverage_ratio', 'coverage', 'gauge', 'fraction of the addresses that the last sweep asked for'),
+                                  ('partial_sweeps_total', 'partial_sweeps', 'counter', 'nr of sweeps that ran out of time and resume in the next cycle'),
+                                  ('uptime_seconds', 'uptime', 'gauge', 'time since the metrics were turned on')):
+        lines.append('# HELP arpscanner_%s %s' % (name, help))
+        lines.append('# TYPE arpscanner_%s %s' % (name, kind))
+        lines.append('arpscanner_%s %r' % (name, snapshot[key]))
+    _summaryLines(lines, 'scan_seconds', snapshot['scan_seconds'], 'duration of the scans')
+    _summaryLines(lines, 'parse_seconds', snapshot['parse_seconds'], 'time spent parsing the output of the arp command, per scan')
+    _summaryLines(lines, 'update_seconds', snapshot['update_seconds'], 'time spent processing a scan result')
+    _summaryLines(lines, 'loop_wait_seconds', snapshot['loop_wait_seconds'], 'time that a task waited for the event loop')
+    _summaryLines(lines, 'loop_hold_seconds', snapshot['loop_hold_seconds'], 'time that a task held the event loop')
+    publish = snapshot.get('publish')
+    if publish:
+        for key in ('sent', 'merged', 'dropped', 'failed'):
+            lines.append('# TYPE arpscanner_publish_%s_total counter' % key)
+            lines.append('arpscanner_publish_%s_total %d' % (key, publish[key]))
+        lines.append('# TYPE arpscanner_publish_queue_depth gauge')
+        lines.append('arpscanner_publish_queue_depth %d' % publish['depth'])
+        _summaryLines(lines, 'publish_latency_seconds', publish['latency'], 'time between queueing a batch of values and the end of its send')
+    ping = snapshot.get('ping')
+    if ping:
+        lines.append('# HELP arpscanner_ping_scheduled_devices nr of devices that the pinger probes')
+        lines.append('# TYPE arpscanner_ping_scheduled_devices gauge')
+        lines.append('arpscanner_ping_scheduled_devices %d' % ping['devices'])
+        lines.append('# HELP arpscanner_pings_total nr of pings sent since pinging was turned on')
+        lines.append('# TYPE arpscanner_pings_total counter')
+        lines.append('arpscanner_pings_total %d' % ping['probes'])
+        lines.append('# HELP arpscanner_pings_per_second average nr of pings per second since pinging was turned on')
+        lines.append('# TYPE arpscanner_pings_per_second gauge')
+        lines.append('arpscanner_pings_per_second %r' % ping['probesPerSecond'])
+    lines.append('# HELP arpscanner_ping_rtt_seconds ping round trip times')
+    lines.append('# TYPE arpscanner_ping_rtt_seconds histogram')
+    devices = snapshot.get('rtt_devices')
+    if devices:
+        for mac in sorted(devices):
+            _histogramLines(lines, 'mac="%s",' % mac, devices[mac])
+    else:
+        _histogramLines(lines, '', snapshot['rtt'])
+    return '\n'.join(lines) + '\n'
+
+
+def writeFile(path, snapshot):
+    """
+    writes the snapshot to a file, as json when the name ends with '.json', otherwise in the prometheus text format.
+    The file is replaced atomically, so a reader never sees a partial file.
+    """
+    if path.endswith('.json'):
+        data = json.dumps(snapshot)
+    else:
+        data = toPrometheus(snapshot)
+    temp = path + '.tmp'
+    with open(temp, 'w') as f:
+        f.write(data)
+    if os.name == 'nt' and os.path.exists(path):       # rename doesn't replace on windows.
+        os.remove(path)
+    os.rename(temp, path)
@@ -0,0 +1,125 @@
+"""
+    Scanning of multiple interfaces or subnets in parallel.
+    Every interface is scanned on it's own worker thread, with it's own timeout, so
+    a slow segment doesn't hold up the others: a scan that is still running at the end of
+    a cycle is picked up in the next cycle.
+"""
+
+import logging
+logger = logging.getLogger('arpscanner')
+import os, time
+from multiprocessing.pool import ThreadPool
+from multiprocessing import TimeoutError
+
+import arpsweep
+import parsers
+
+GRACE_PERIOD = 0.5                  # extra time that a scan gets to deliver it's (partial) result after it's own deadline.
+PENDING = 'pending'                 # the result of an interface whose scan is still running.
+
+
+def parseConfig(value, defaultTimeout):
+    """
+    converts the value of the interfaces asset into a list of (interface, timeout) tuples.
+    :param value: list of interface names or subnets (ex: "wlan0", "192.168.2.0/24", subnets only work with arp-scan), or objects with the
+                  fields 'interface' and (optional) 'timeout' (in seconds).
+    :param defaultTimeout: the timeout for the entries that don't specify one.
+    :return: list of (interface, timeout)
+    """
+    result = []
+    for item in value or []:
+        if isinstance(item, dict):
+            result.append((str(item['interface']), float(item.get('timeout', defaultTimeout))))
+        else:
+            result.append((str(item), float(defaultTimeout)))
+    return result
+
+
+def getInterfaceCommand(command, interface):
+    """
+    builds the command that scans a single interface or subnet, based on the configured arp command.
+    :param command: the arp command
+    :param interface: the name of the interface, or a subnet (ex: 192.168.2.0/24)
+    :return: the command line for the interface.
+    """
+    if arpsweep.isNativeCommand(command):
+        return arpsweep.NATIVE_COMMAND + ' ' + interface
+    parser = parsers.getParser(command)
+    if parser == parsers.parseArpScan:
+        if '/' in interface:                                    # a subnet replaces the local network.
+            return ' '.join(interface if part in ('-l', '--localnet') else part for part in command.split())
+        return command + ' -I ' + interface
+    if parser == parsers.parseIpNeigh:
+        if command.split()[-1] in ('neigh', 'neighbour'):
+            command += ' show'
+        return command + ' dev ' + interface
+    if parser == parsers.parseArpA:
+        if os.name == 'nt':
+            return command + ' -N ' + interface                # on windows, the interface is specified by it's ip address.
+        return command + ' -i ' + interface
+    return command
+
+
+class MultiScanner(object):
+    """
+    runs the scans of all the interfaces on a pool of worker threads.
+    """
+    def __init__(self):
+        self._pool = None
+        self._size = 0
+        self._running = {}                  # interface -> (start time, timeout, async result) of the scans that were started.
+
+    def _getPool(self, size):
+        if size != self._size:
+            self.close()
+            self._pool = ThreadPool(size)
+            self._size = size
+        return self._pool
+
+    def isBusy(self):
+        """:return: True while the scan of an interface is still running from a previous call."""
+        return bool(self._running)
+
+    def scan(self, scanFunc, jobs, wait=None):
+        """
+        scans all the interfaces at the same time. An interface whose scan is still running from a previous call
+        isn't scanned again, the result of that scan is returned instead.
+        :param scanFunc: function that performs a single scan, called with (command, timeout), returns dict of mac -> ip
+        :param jobs: list of (interface, command, timeout)
+        :param wait: max nr of seconds to wait for the scans, None to wait until they are done or timed out.
+        :return: list of (interface, result), result is None for the interfaces that failed or didn't finish in time,
+                 PENDING for the ones that are still running after 'wait' seconds.
+        """
+        pool = self._getPool(len(jobs))
+        start = time.time()
+        for interface in set(self._running).difference(job[0] for job in jobs):       # no longer configured.
+            del self._running[interface]
+        for interface, command, timeout in jobs:
+            if interface not in self._running:
+                self._running[interface] = (start, timeout, pool.apply_async(scanFunc, (command, timeout)))
+        results = []
+        for interface, command, timeout in jobs:
+            started, timeout, job = self._running[interface]
+            deadline = started + timeout + GRACE_PERIOD
+            if wait is not None and start + wait < deadline:
+                job.wait(max(start + wait - time.time(), 0))
+                if not job.ready():
+                    results.append((interface, PENDING))
+                    continue
+            del self._running[interface]
+            try:
+                results.append((interface, job.get(max(deadline - time.time(), 0))))
+            except TimeoutError:
+                logger.error("scan of %s did not finish within %s seconds", interface, timeout)
+                results.append((interface, None))
+            except Exception:
+                logger.exception("scan of %s failed", interface)
+                results.append((interface, None))
+        return results
+
+    def close(self):
+        if self._pool:
+            self._pool.terminate()
+            self._pool = None
+            self._size = 0
+        self._running.clear()
@@ -0,0 +1,216 @@
+"""
+    Kernel neighbour table backend: instead of scanning the network, the neighbour (arp) cache
+    that the kernel already maintains is used. Changes are received as rtnetlink
+    RTM_NEWNEIGH/RTM_DELNEIGH events. When netlink isn't available, /proc/net/arp
+    is polled instead and compared with the previous read.
+
+    Note: the kernel only refreshes entries for devices that it talks to, so departures
+    are detected best in combination with ping (which makes the kernel re-validate the entries).
+"""
+
+import logging
+logger = logging.getLogger('arpscanner')
+import socket, struct, select, time
+from threading import Thread, Lock
+
+NEIGHBOUR_COMMAND = 'kernel'        # value of the arp command asset that selects this backend.
+PROC_ARP_PATH = '/proc/net/arp'
+
+NETLINK_ROUTE = 0
+RTMGRP_NEIGH = 0x4
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+RTM_GETNEIGH = 30
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NDA_DST = 1
+NDA_LLADDR = 2
+
+NUD_INCOMPLETE = 0x01
+NUD_FAILED = 0x20
+NUD_NOARP = 0x40
+NUD_ABSENT = NUD_INCOMPLETE | NUD_FAILED        # all other states mean that the kernel has a valid mac for the address.
+ATF_COM = 0x2                                   # flag in /proc/net/arp: the entry is complete.
+
+_NLMSGHDR = struct.Struct('=IHHII')
+_NDMSG = struct.Struct('=BBHiHBB')
+_RTATTR = struct.Struct('=HH')
+
+
+def isNeighbourCommand(command):
+    """checks if the arp command selects the kernel neighbour table backend."""
+    return bool(command) and command.strip() == NEIGHBOUR_COMMAND
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def parseNeighMessages(data):
+    """
+    parses a buffer of netlink messages, as received from a NETLINK_ROUTE socket.
+    :param data: the raw bytes that were received.
+    :return: a list of (present, mac, ip) tuples, 1 for every ipv4 neighbour message that contains an address.
+             mac is None when the kernel doesn't know it (yet). Parsing stops at NLMSG_DONE.
+    """
+    result = []
+    pos = 0
+    while pos + _NLMSGHDR.size <= len(data):
+        length, msgType, flags, seq, pid = _NLMSGHDR.unpack_from(data, pos)
+        if length < _NLMSGHDR.size or msgType == NLMSG_DONE:
+            break
+        if msgType in (RTM_NEWNEIGH, RTM_DELNEIGH):
+            body = pos + _NLMSGHDR.size
+            family, pad1, pad2, ifindex, state, ndFlags, ndType = _NDMSG.unpack_from(data, body)
+            if family == socket.AF_INET:
+                ip = mac = None
+                attr = body + _NDMSG.size
+                while attr + _RTATTR.size <= pos + length:
+                    attrLen, attrType = _RTATTR.unpack_from(data, attr)
+                    if attrLen < _RTATTR.size:
+                        break
+                    value = data[attr + _RTATTR.size:attr + attrLen]
+                    if attrType == NDA_DST and len(value) == 4:
+                        ip = socket.inet_ntoa(value)
+                    elif attrType == NDA_LLADDR and len(value) == 6:
+                        mac = ':'.join('%02x' % ord(c) for c in value)
+                    attr += _align(attrLen)
+                if ip:
+                    present = msgType == RTM_NEWNEIGH and not state & NUD_ABSENT and not state & NUD_NOARP
+                    result.append((present and mac is not None, mac, ip))
+        pos += _align(length)
+    return result
+
+
+def readProcArp(path=PROC_ARP_PATH):
+    """
+    reads the complete entries of the kernel arp table.
+    :param path: the file to read, can be replaced by a recorded copy.
+    :return: dict of mac -> ip
+    """
+    result = {}
+    with open(path) as f:
+        f.readline()                                # header
+        for line in f:
+            item = line.split()
+            if len(item) >= 4 and int(item[2], 16) & ATF_COM:
+                result[item[3].lower()] = item[0]
+    return result
+
+
+class ProcArpReader(object):
+    """reads /proc/net/arp and reports the differences with the previous read."""
+    def __init__(self, path=PROC_ARP_PATH):
+        self.path = path
+        self.devices = {}
+
+    def update(self):
+        """
+        re-reads the table.
+        :return: a list of (present, mac, ip) tuples for all the entries that changed since the previous read.
+        """
+        current = readProcArp(self.path)
+        changes = []
+        for mac, ip in current.iteritems():
+            if self.devices.get(mac) != ip:
+                changes.append((True, mac, ip))
+        for mac, ip in self.devices.iteritems():
+            if mac not in current:
+                changes.append((False, mac, ip))
+        self.devices = current
+        return changes
+
+
+class NeighbourMonitor(Thread):
+    """
+    keeps a copy of the kernel neighbour table up to date, through rtnetlink events
+    or by polling /proc/net/arp if netlink can't be used.
+    """
+    def __init__(self, onChange=None, pollInterval=1.0, procPath=PROC_ARP_PATH):
+        """
+        :param onChange: optional callback, called with (present, mac, ip) for every change in the table.
+        :param pollInterval: the nr of seconds between 2 reads of the /proc file, when netlink isn't available.
+        :param procPath: the location of the kernel arp table file.
+        """
+        Thread.__init__(self)
+        self.daemon = True
+        self.isRunning = True
+        self.onChange = onChange
+        self.pollInterval = pollInterval
+        self.procPath = procPath
+        self._devices = {}
+        self._byIp = {}                                         # ip -> mac, for the delete events that don't carry the mac.
+        self._lock = Lock()
+
+    def getDevices(self):
+        """:return: a copy of the current table, as a dict of mac -> ip (same format as findDevices)"""
+        self._lock.acquire()
+        try:
+            return dict(self._devices)
+        finally:
+            self._lock.release()
+
+    def apply(self, changes):
+        """updates the table with a list of (present, mac, ip) tuples and reports the effective changes."""
+        for present, mac, ip in changes:
+            self._lock.acquire()
+            try:
+                if present:
+                    previous = self._devices.get(mac)
+                    changed = previous != ip
+                    if changed and previous and self._byIp.get(previous) == mac:
+                        del self._byIp[previous]
+                    self._devices[mac] = ip
+                    self._byIp[ip] = mac
+                else:
+                    if mac is None:                                 # delete events don't always carry the mac.
+                        mac = self._byIp.get(ip)
+                    changed = mac is not None and mac in self._devices
+                    if changed:                                     # incomplete/failed entries of unknown addresses are common.
+                        ip = self._devices.pop(mac)
+                        if self._byIp.get(ip) == mac:
+                            del self._byIp[ip]
+            finally:
+                self._lock.release()
+            if changed and self.onChange:
+                try:
+                    self.onChange(present, mac, ip)
+                except:
+                    logger.exception("failed to process neighbour change")
+
+    def _openNetlink(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        sock.bind((0, RTMGRP_NEIGH))
+        request = _NDMSG.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0)
+        sock.send(_NLMSGHDR.pack(_NLMSGHDR.size + len(request), RTM_GETNEIGH, NLM_F_REQUEST | NLM_F_DUMP, 1, 0) + request)
+        return sock
+
+    def _runNetlink(self, sock):
+        while self.isRunning:
+            if select.select([sock], [], [], 1)[0]:                 # wake up regularly, so we can stop.
+                self.apply(parseNeighMessages(sock.recv(65536)))
+
+    def _runProc(self):
+        reader = ProcArpReader(self.procPath)
+        while self.isRunning:
+            self.apply(reader.update())
+            time.sleep(self.pollInterval)
+
+    def run(self):
+        try:
+            sock = self._openNetlink()
+        except socket.error:
+            logger.warning("netlink not available, falling back to polling " + self.procPath)
+            sock = None
+        try:
+            if sock:
+                try:
+                    self._runNetlink(sock)
+                finally:
+                    sock.close()
+            else:
+                self._runProc()
+        except:
+            logger.exception("neighbour monitor failed")
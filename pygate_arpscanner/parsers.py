@@ -0,0 +1,143 @@
+"""
+    Parsers for the output of the external commands that can be used to find the devices on the network
+    (arp-scan, ip neigh, arp -a, arp -an).
+    The output is processed line by line while the command is running, so results are available
+    before the process exits, and the process is killed when it doesn't finish in time.
+"""
+
+import logging
+logger = logging.getLogger('arpscanner')
+import os, re, signal, subprocess, time
+from threading import Timer
+
+_ip_re = re.compile(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$')
+_mac_re = re.compile(r'^[0-9a-fA-F]{1,2}([:-][0-9a-fA-F]{1,2}){5}$')
+_parsers = {}                       # command name -> parser function
+
+
+def register(command, parser):
+    """
+    registers a parser for the output of a command.
+    :param command: the name of the command, optionally with the arguments that select the output format (ex: 'arp -an').
+    :param parser: function that takes a single line of output and returns (mac, ip) or None if the line doesn't contain a device.
+    """
+    _parsers[command] = parser
+
+
+def normalizeMac(mac):
+    """converts a mac address to lower case, ':' separated, 2 digits per byte (same as arp-scan output)."""
+    return ':'.join('%02x' % int(part, 16) for part in re.split('[:-]', mac))
+
+
+def _device(mac, ip):
+    if _mac_re.match(mac) and _ip_re.match(ip):
+        return normalizeMac(mac), ip
+    return None
+
+
+def parseArpScan(line):
+    """'192.168.1.1	aa:bb:cc:dd:ee:ff	(vendor)', header and footer lines are skipped."""
+    item = line.split()
+    if len(item) >= 2:
+        return _device(item[1], item[0])
+    return None
+
+
+def parseIpNeigh(line):
+    """'192.168.1.1 dev eth0 lladdr aa:bb:cc:dd:ee:ff REACHABLE', entries without lladdr (FAILED, INCOMPLETE) are skipped."""
+    item = line.split()
+    if 'lladdr' in item and item[-1] != 'FAILED':
+        pos = item.index('lladdr')
+        if pos + 1 < len(item):
+            return _device(item[pos + 1], item[0])
+    return None
+
+
+def parseArpA(line):
+    """
+    windows: '  192.168.1.1   aa-bb-cc-dd-ee-ff   dynamic'
+    linux/bsd: 'host (192.168.1.1) at aa:bb:cc:dd:ee:ff [ether] on eth0'
+    """
+    item = line.split()
+    if len(item) == 3 and item[2] == 'dynamic':
+        return _device(item[1], item[0])
+    if len(item) >= 4 and item[2] == 'at':
+        return _device(item[3], item[1].strip('()'))
+    return None
+
+
+register('arp-scan', parseArpScan)
+register('ip neigh', parseIpNeigh)
+register('ip neighbour', parseIpNeigh)
+register('arp -a', parseArpA)
+register('arp -an', parseArpA)
+
+
+def getParser(command):
+    """
+    finds the parser for a command line. 'sudo' and the path of the executable are ignored, the most specific
+    registered command wins (ex: 'sudo /usr/sbin/arp -an' -> 'arp -an').
+    :return: the parser function. Defaults to the arp-scan parser.
+    """
+    item = [part for part in command.split() if part != 'sudo']
+    if item:
+        item[0] = os.path.basename(item[0])
+    normalized = ' '.join(item)
+    for key in sorted(_parsers.keys(), key=len, reverse=True):
+        if normalized == key or normalized.startswith(key + ' '):
+            return _parsers[key]
+    return parseArpScan
+
+
+def _kill(proc):
+    """kills the process and everything it started (the shell, sudo, ...)"""
+    try:
+        if os.name == 'nt':
+            proc.kill()
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass                            # already gone.
+
+
+def streamDevices(command, timeout, timing=None):
+    """
+    runs the command and yields the devices as they are reported.
+    :param command: the command line to execute.
+    :param timeout: the max nr of seconds that the command is allowed to run, after that it is killed.
+    :param timing: optional dict, the time spent parsing the output is added to it's 'parse' field.
+    :return: generator of (mac, ip) tuples
+    """
+    parser = getParser(command)
+    if os.name == 'nt':
+        proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
+    else:
+        proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, preexec_fn=os.setsid)   # own process group, so the whole tree can be killed.
+    expired = []
+    def onTimeout():
+        expired.append(True)
+        _kill(proc)
+    timer = Timer(timeout, onTimeout)
+    timer.start()
+    try:
+        for line in iter(proc.stdout.readline, ''):
+            if timing is not None:
+                start = time.time()
+            try:
+                found = parser(line)
+            except Exception:
+                logger.debug("failed to parse line: %s", line)
+                continue
+            finally:
+                if timing is not None:
+                    timing['parse'] = timing.get('parse', 0.0) + time.time() - start
+            if found:
+                yield found
+    finally:
+        timer.cancel()
+        if proc.poll() is None:             # the caller stopped early, or the deadline passed.
+            _kill(proc)
+        proc.stdout.close()
+        proc.wait()
+        if expired:
+            logger.error("'%s' killed: did not finish within %s seconds", command, timeout)
@@ -82,19 +82,58 @@ else:
 ICMP_ECHO_REQUEST = 8 # Seems to be the same on Solaris.
 
 
+def _sum_words(byte_order, data):
+    """
+    Sum the 16 bit words in >data< (which must have an even length).
+    """
+    return sum(struct.unpack("%s%dH" % (byte_order, len(data) / 2), data))
+
+
+def _fold(sum):
+    """
+    Fold the carries of a one's complement sum back into 16 bits.
+    """
+    while sum >> 16:
+        sum = (sum & 0xffff) + (sum >> 16)
+    return sum
+
+
+def update_checksum(my_checksum, old_data, new_data):
+    """
+    Incrementally update an internet checksum (in network byte order) for a
+    change in the packet, as in RFC 1624 eqn. 3: HC' = ~(~HC + ~m + m'),
+    for every 16 bit word m that changed into m'. >old_data< and >new_data<
+    must have the same even length and start at an even offset in the packet.
+    """
+    format = "!%dH" % (len(old_data) / 2)
+    sum = ~my_checksum & 0xffff
+    for old, new in zip(struct.unpack(format, old_data), struct.unpack(format, new_data)):
+        sum += (~old & 0xffff) + new
+    return ~_fold(sum) & 0xffff
+
+
+def resolve(dest_addr):
+    """
+    Returns the ip address of >dest_addr<. Literal ip addresses are returned
+    as they are, without a DNS lookup.
+    """
+    if dest_addr.count(".") == 3:
+        try:
+            socket.inet_aton(dest_addr)
+            return dest_addr
+        except socket.error:
+            pass
+    return socket.gethostbyname(dest_addr)
+
+
 def checksum(source_string):
     """
     I'm not too confident that this is right but testing seems
     to suggest that it gives the same answers as in_cksum in ping.c
     """
-    sum = 0
     countTo = (len(source_string)/2)*2
-    count = 0
-    while count<countTo:
-        thisVal = ord(source_string[count + 1])*256 + ord(source_string[count])
-        sum = sum + thisVal
-        sum = sum & 0xffffffff # Necessary?
-        count = count + 2
+    # Sum all the 16 bit words at once, instead of 1 byte at a time.
+    sum = _sum_words("<", source_string[:countTo])
 
     if countTo<len(source_string):
         sum = sum + ord(source_string[len(source_string) - 1])
@@ -114,68 +153,94 @@ def checksum(source_string):
 def receive_one_ping(my_socket, ID, timeout):
     """
     receive the ping from the socket.
+    Returns the delay (in seconds) of the first echo reply for >ID<, or None on timeout.
     """
-    timeLeft = timeout
+    deadline = default_timer() + timeout
     while True:
-        startedSelect = default_timer()
-        whatReady = select.select([my_socket], [], [], timeLeft)
-        howLongInSelect = (default_timer() - startedSelect)
-        if whatReady[0] == []: # Timeout
+        timeLeft = deadline - default_timer()
+        if timeLeft <= 0 or not select.select([my_socket], [], [], timeLeft)[0]: # Timeout
             return
-
-        timeReceived = default_timer()
         recPacket, addr = my_socket.recvfrom(1024)
-        icmpHeader = recPacket[20:28]
-        type, code, checksum, packetID, sequence = struct.unpack(
-            "bbHHh", icmpHeader
-        )
-        # Filters out the echo request itself. 
-        # This can be tested by pinging 127.0.0.1 
-        # You'll see your own request
-        if type != 8 and packetID == ID:
-            bytesInDouble = struct.calcsize("d")
-            timeSent = struct.unpack("d", recPacket[28:28 + bytesInDouble])[0]
-            return timeReceived - timeSent
-
-        timeLeft = timeLeft - howLongInSelect
-        if timeLeft <= 0:
-            return
+        reply = parse_reply(recPacket, ID, default_timer())
+        if reply:
+            return reply[1]
 
 
-def send_one_ping(my_socket, dest_addr, ID):
+def send_one_ping(my_socket, dest_addr, ID, sequence = 1):
     """
-    Send one ping to the given >dest_addr<.
+    Send one ping to the given >dest_addr<. The packet is made from an EchoTemplate,
+    use an IcmpProber to send more than 1 ping.
     """
-    dest_addr  =  socket.gethostbyname(dest_addr)
+    my_socket.sendto(EchoTemplate(ID).build(sequence), (resolve(dest_addr), 1))
 
-    # Header is type (8), code (8), checksum (16), id (16), sequence (16)
-    my_checksum = 0
 
-    # Make a dummy heder with a 0 checksum.
-    header = struct.pack("bbHHh", ICMP_ECHO_REQUEST, 0, my_checksum, ID, 1)
-    bytesInDouble = struct.calcsize("d")
-    data = (192 - bytesInDouble) * "Q"
-    data = struct.pack("d", default_timer()) + data
+def parse_reply(recPacket, ID, timeReceived):
+    """
+    checks if a received packet is an echo reply for one of our pings.
+    Returns (sequence, delay) or None if the packet is not a reply for us.
+    """
+    icmpHeader = recPacket[20:28]
+    if len(icmpHeader) < 8:
+        return
+    type, code, checksum, packetID, sequence = struct.unpack(
+        "bbHHh", icmpHeader
+    )
+    if type != 8 and packetID == ID:
+        bytesInDouble = struct.calcsize("d")
+        timeSent = struct.unpack("d", recPacket[28:28 + bytesInDouble])[0]
+        return sequence, timeReceived - timeSent
 
-    # Calculate the checksum on the data and the dummy header.
-    my_checksum = checksum(header + data)
 
-    # Now that we have the right checksum, we put that in. It's just easier
-    # to make up a new header than to stuff it into the dummy.
-    header = struct.pack(
-        "bbHHh", ICMP_ECHO_REQUEST, 0, socket.htons(my_checksum), ID, 1
-    )
-    packet = header + data
-    my_socket.sendto(packet, (dest_addr, 1)) # Don't know about the 1
+def read_replies(my_socket, ID):
+    """
+    reads all the packets that are available on a non-blocking socket.
+    Returns a list of (address, sequence, delay) for the echo replies to our pings.
+    """
+    result = []
+    while True:
+        try:
+            recPacket, addr = my_socket.recvfrom(1024)
+        except socket.error:
+            return result
+        reply = parse_reply(recPacket, ID, default_timer())
+        if reply:
+            result.append((addr[0], reply[0], reply[1]))
 
 
-def do_one(dest_addr, timeout):
+def receive_many_pings(my_socket, ID, pending, timeout):
     """
-    Returns either the delay (in seconds) or none on timeout.
+    receive the replies for all the pings in >pending< from the socket.
+    pending maps (address, sequence) to the address that was pinged. Entries
+    are removed as their reply comes in, so whatever remains has timed out.
+    Returns a dict of address -> delay (in seconds).
+    """
+    result = {}
+    deadline = default_timer() + timeout
+    while pending:
+        timeLeft = deadline - default_timer()
+        if timeLeft <= 0:
+            break
+        whatReady = select.select([my_socket], [], [], timeLeft)
+        if whatReady[0] == []: # Timeout
+            break
+
+        timeReceived = default_timer()
+        recPacket, addr = my_socket.recvfrom(1024)
+        reply = parse_reply(recPacket, ID, timeReceived)
+        if reply:
+            dest_addr = pending.pop((addr[0], reply[0]), None)
+            if dest_addr is not None:
+                result[dest_addr] = reply[1]
+    return result
+
+
+def open_socket():
+    """
+    Create the raw ICMP socket used to send the pings.
     """
     icmp = socket.getprotobyname("icmp")
     try:
-        my_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, icmp)
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW, icmp)
     except socket.error, (errno, msg):
         if errno == 1:
             # Operation not permitted
@@ -186,13 +251,122 @@ def do_one(dest_addr, timeout):
             raise socket.error(msg)
         raise # raise the original error
 
-    my_ID = os.getpid() & 0xFFFF
 
-    send_one_ping(my_socket, dest_addr, my_ID)
-    delay = receive_one_ping(my_socket, my_ID, timeout)
+class EchoTemplate(object):
+    """
+    Echo request packet that is built once: only the sequence number and
+    the timestamp differ between packets, so the checksum of the template is
+    updated incrementally instead of being calculated over the whole packet.
+    """
+
+    def __init__(self, ID, packet_size = 192):
+        bytesInDouble = struct.calcsize("d")
+        # The sequence number and timestamp are 0 in the template.
+        header = struct.pack("bbHHh", ICMP_ECHO_REQUEST, 0, 0, ID, 0)
+        template = header + "\0" * bytesInDouble + (packet_size - bytesInDouble) * "Q"
+        self._template_checksum = ~_fold(_sum_words("!", template)) & 0xffff
+        self._type_code = template[0:2]
+        self._id = template[4:6]
+        self._blank = template[6:8 + bytesInDouble]         # sequence + timestamp
+        self._data = template[8 + bytesInDouble:]
+
+    def build(self, sequence, timestamp = None):
+        """
+        Make the echo request packet with the given sequence number.
+        """
+        if timestamp is None:
+            timestamp = default_timer()
+        variable = struct.pack("h", sequence) + struct.pack("d", timestamp)
+        my_checksum = update_checksum(self._template_checksum, self._blank, variable)
+        return self._type_code + struct.pack("!H", my_checksum) + self._id + variable + self._data
+
+
+class IcmpProber(object):
+    """
+    Long lived pinger that owns a single raw socket and makes the echo
+    requests from an EchoTemplate.
+    """
 
-    my_socket.close()
-    return delay
+    def __init__(self, ID = None, packet_size = 192, my_socket = None):
+        """
+        >my_socket< can be used to provide the socket, otherwise a raw icmp socket is opened.
+        """
+        if my_socket is None:
+            my_socket = open_socket()
+        self.socket = my_socket
+        if ID is None:
+            ID = os.getpid() & 0xFFFF
+        self.ID = ID
+        self.template = EchoTemplate(ID, packet_size)
+
+    def send(self, dest_addr, sequence):
+        """
+        Send one ping to >dest_addr<. Returns the ip address that was pinged.
+        """
+        ip = resolve(dest_addr)
+        self.socket.sendto(self.template.build(sequence), (ip, 1))
+        return ip
+
+    def read_replies(self):
+        """
+        Reads the replies that are available, the socket must be non-blocking.
+        Returns a list of (address, sequence, delay).
+        """
+        return read_replies(self.socket, self.ID)
+
+    def ping_many(self, dest_addrs, timeout):
+        """
+        Ping all the addresses in >dest_addrs< at once. All the requests are
+        sent first, after which the replies are collected and matched on ID
+        and sequence number, so a full sweep takes at most >timeout< seconds,
+        no matter how many addresses there are.
+        Returns a dict of address -> delay (in seconds). Addresses that did not
+        reply in time are not included.
+        """
+        pending = {}
+        for sequence, dest_addr in enumerate(dest_addrs):
+            sequence = sequence & 0x7FFF
+            try:
+                ip = self.send(dest_addr, sequence)
+            except socket.error:
+                continue                                # unreachable or unresolvable: counts as no reply.
+            pending[(ip, sequence)] = dest_addr
+        return receive_many_pings(self.socket, self.ID, pending, timeout)
+
+    def ping(self, dest_addr, timeout):
+        """
+        Returns either the delay (in seconds) or none on timeout.
+        """
+        ip = self.send(dest_addr, 1)
+        return receive_many_pings(self.socket, self.ID, {(ip, 1): dest_addr}, timeout).get(dest_addr)
+
+    def close(self):
+        self.socket.close()
+
+
+def do_many(dest_addrs, timeout):
+    """
+    Ping all the addresses in >dest_addrs< at once, over a single socket.
+    Returns a dict of address -> delay (in seconds), see IcmpProber.ping_many.
+    """
+    if not dest_addrs:
+        return {}
+    prober = IcmpProber()
+    try:
+        return prober.ping_many(dest_addrs, timeout)
+    finally:
+        prober.close()
+
+
+def do_one(dest_addr, timeout):
+    """
+    Returns either the delay (in seconds) or none on timeout.
+    """
+    prober = IcmpProber()
+    try:
+        return prober.ping(dest_addr, timeout)
+    finally:
+        prober.close()
 
 
 def verbose_ping(dest_addr, timeout = 2, count = 4):
@@ -0,0 +1,128 @@
+"""
+    Sends the state changes to the cloud from a separate thread, so that a slow connection
+    never holds up the scanning.
+    Changes are queued per asset: when an asset changes again before the previous value was sent,
+    only the last value is sent. The queue is bounded, new assets are dropped when it is full.
+"""
+
+import logging
+logger = logging.getLogger('arpscanner')
+import time
+from threading import Thread, Condition
+from collections import OrderedDict
+
+import metrics
+
+
+class Publisher(Thread):
+    """
+    queues the values for the assets of a device and sends them in batches.
+    """
+    def __init__(self, device, maxSize=10000, window=0.2):
+        """
+        :param device: the pygate device object that is used to send the values.
+        :param maxSize: the max nr of assets that can be waiting to be sent.
+        :param window: the nr of seconds that the sender waits for more changes before sending a batch, unless flush is called.
+        """
+        Thread.__init__(self)
+        self.daemon = True
+        self.isRunning = True
+        self.device = device
+        self.maxSize = maxSize
+        self.window = window
+        self._pending = OrderedDict()           # asset id -> value
+        self._flushRequested = False
+        self._queuedAt = None                   # the time at which the oldest value in the queue was published.
+        self._cond = Condition()
+        self.sent = 0                           # nr of values that were sent.
+        self.merged = 0                         # nr of values that replaced a value that was still waiting.
+        self.dropped = 0                        # nr of values that were discarded because the queue was full.
+        self.failed = 0                         # nr of values that could not be sent.
+        self.latency = metrics.Summary()        # time between the first value of a batch being queued and the end of the send of the batch.
+        self.onFailed = None                    # optional function(assetId), called from the sender's thread when a value could not be sent.
+
+    def publish(self, value, assetId, merge=None):
+        """
+        queues a value for an asset, same arguments as device.send. Never blocks on the network.
+        :param merge: optional function(queued, value) that combines the value with the one that is still waiting to
+                      be sent, for values that are changes instead of states. By default the new value replaces it.
+        :return: False if the value was dropped because the queue is full.
+        """
+        self._cond.acquire()
+        try:
+            if assetId in self._pending:
+                self.merged += 1
+                if merge:
+                    value = merge(self._pending[assetId], value)
+            elif len(self._pending) >= self.maxSize:
+                self.dropped += 1
+                logger.error("publish queue full, value for %s dropped", assetId)
+                return False
+            elif not self._pending:
+                self._queuedAt = time.time()
+            self._pending[assetId] = value
+            self._cond.notify()
+            return True
+        finally:
+            self._cond.release()
+
+    def flush(self):
+        """sends all the queued values right away, without waiting for the window to close. Doesn't wait for the send."""
+        self._cond.acquire()
+        try:
+            if self._pending:
+                self._flushRequested = True
+                self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def getStats(self):
+        """:return: dict with the queue depth and the counters."""
+        self._cond.acquire()
+        try:
+            return {'depth': len(self._pending), 'sent': self.sent, 'merged': self.merged, 'dropped': self.dropped, 'failed': self.failed,
+                    'latency': self.latency.toDict()}
+        finally:
+            self._cond.release()
+
+    def stop(self):
+        """stops the sender, after the values that are still queued have been sent."""
+        self._cond.acquire()
+        try:
+            self.isRunning = False
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def _nextBatch(self):
+        self._cond.acquire()
+        try:
+            while self.isRunning and not self._pending:
+                self._cond.wait()
+            if self._pending:
+                deadline = self._queuedAt + self.window     # collect the other changes of the same cycle, every publish wakes us up.
+                while self.isRunning and not self._flushRequested and time.time() < deadline:
+                    self._cond.wait(deadline - time.time())
+            batch = self._pending
+            self._pending = OrderedDict()
+            self._flushRequested = False
+            return batch, self._queuedAt
+        finally:
+            self._cond.release()
+
+    def run(self):
+        while True:
+            batch, queuedAt = self._nextBatch()
+            if not batch and not self.isRunning:
+                break
+            for assetId, value in batch.iteritems():
+                try:
+                    self.device.send(value, assetId)
+                    self.sent += 1
+                except:
+                    self.failed += 1
+                    logger.exception("failed to send value for " + str(assetId))
+                    if self.onFailed:
+                        self.onFailed(assetId)
+            if batch:
+                self.latency.observe(time.time() - queuedAt)
@@ -0,0 +1,176 @@
+"""
+    Registry of the tracked devices, sized for tens of thousands of macs on a small gateway.
+    Every mac is converted once to a 48 bit integer, whatever the notation it came in (case, ':', '-', '.' or
+    no separators), so the backends and the user's list always match. The records use __slots__ instead of a
+    __dict__ per device, and an ip -> mac index resolves replies by address without a search.
+    Scan results are matched through an index of the notation that all the scanners use (aa:bb:cc:dd:ee:ff),
+    so the hosts of a scan don't have to be converted.
+"""
+
+import re
+
+_separators_re = re.compile('[:.-]')
+
+
+def macToInt(mac):
+    """
+    converts a mac address to an integer.
+    :param mac: the mac as a string in any of the common notations (aa:bb:cc:dd:ee:ff, AA-BB-CC-DD-EE-FF, aabb.ccdd.eeff,
+                aabbccddeeff, a:b:c:d:e:f), or an integer, which is returned as is.
+    :return: the integer value of the mac.
+    :raise ValueError: when the string is not a mac address.
+    """
+    if isinstance(mac, (int, long)):
+        return mac
+    digits = mac.replace(':', '')
+    if len(digits) != 12:                               # other separators, or bytes that are not 0 padded.
+        parts = _separators_re.split(mac)
+        if len(parts) == 6:
+            digits = ''.join(part.rjust(2, '0') for part in parts)
+        else:
+            digits = ''.join(parts)
+        if len(digits) != 12:
+            raise ValueError("not a mac address: %s" % mac)
+    return int(digits, 16)
+
+
+def formatMac(value):
+    """converts an integer mac address to the 'aa:bb:cc:dd:ee:ff' notation."""
+    digits = '%012x' % value
+    return ':'.join(digits[i:i + 2] for i in xrange(0, 12, 2))
+
+
+class Tracked(object):
+    """the state of a tracked device."""
+    __slots__ = ('key', 'name', 'present', 'ip', 'changeCount', 'lastSeen', 'rtt')
+
+    def __init__(self, key, name, present = False):
+        self.key = key                      # the mac, as an integer.
+        self.name = name
+        self.present = present              # the last state that was sent to the cloud. Seeded once from the asset state cache, after that we are the authority.
+        self.ip = None                      # the ip address for this device being tracked. Change it with Registry.setIp, so the index stays up to date.
+        self.changeCount = 0                # sometimes a device disapears 1 cycle, but it's still there, so we compensate
+        self.lastSeen = None                # the last time the device was found on the network.
+        self.rtt = None                     # the round trip time of the last ping reply, in seconds.
+
+
+class Registry(object):
+    """
+    the tracked devices, indexed by mac (as integer) and by ip address.
+    Lookups accept the mac in any notation.
+    """
+    def __init__(self):
+        self._devices = {}                  # mac (int) -> Tracked
+        self._byIp = {}                     # ip -> mac (int)
+        self._byName = {}                   # mac in the notation of the scanners -> mac (int)
+
+    def add(self, mac, name, present = False):
+        """
+        adds a device, or returns the existing record if it is already tracked.
+        :return: the Tracked record.
+        """
+        key = macToInt(mac)
+        tracked = self._devices.get(key)
+        if not tracked:
+            tracked = self._devices[key] = Tracked(key, name, present)
+            self._byName[formatMac(key)] = key
+        return tracked
+
+    def get(self, mac, default = None):
+        try:
+            return self._devices.get(macToInt(mac), default)
+        except ValueError:
+            return default
+
+    def __getitem__(self, mac):
+        try:
+            return self._devices[mac]                   # most lookups are done with the integer.
+        except KeyError:
+            return self._devices[macToInt(mac)]
+
+    def __contains__(self, mac):
+        try:
+            return macToInt(mac) in self._devices
+        except ValueError:
+            return False
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __iter__(self):
+        return iter(self._devices)
+
+    def keys(self):
+        """:return: the macs of the tracked devices, as integers."""
+        return self._devices.keys()
+
+    def viewkeys(self):
+        return self._devices.viewkeys()
+
+    def itervalues(self):
+        return self._devices.itervalues()
+
+    def clear(self):
+        self._devices.clear()
+        self._byIp.clear()
+        self._byName.clear()
+
+    def setIp(self, tracked, ip):
+        """
+        changes the ip address of a device and keeps the ip index up to date.
+        :return: True when the address changed.
+        """
+        if tracked.ip == ip:
+            return False
+        if tracked.ip and self._byIp.get(tracked.ip) == tracked.key:
+            del self._byIp[tracked.ip]
+        tracked.ip = ip
+        if ip:
+            self._byIp[ip] = tracked.key                # a reused address now belongs to this device.
+        return True
+
+    def updateSeen(self, devices, now):
+        """
+        stores the addresses and the time of a scan result.
+        :param devices: dict of mac (int) -> ip, as returned by match.
+        :param now: the time of the scan.
+        :return: the nr of devices whose address changed.
+        """
+        tracked = self._devices
+        changed = 0
+        for key, ip in devices.iteritems():
+            device = tracked[key]
+            device.lastSeen = now
+            if device.ip != ip:
+                self.setIp(device, ip)
+                changed += 1
+        return changed
+
+    def byIp(self, ip):
+        """:return: the mac (as integer) of the tracked device that has the ip address, or None."""
+        return self._byIp.get(ip)
+
+    def match(self, devices):
+        """
+        filters the tracked devices out of a scan result.
+        :param devices: dict of mac -> ip, the macs as strings in any notation or as integers.
+        :return: dict of mac (int) -> ip for the devices that are tracked.
+        """
+        names = self._byName
+        common = names.viewkeys() & devices.viewkeys()
+        result = dict(zip(map(names.__getitem__, common), map(devices.__getitem__, common)))     # map instead of a loop: this runs for every host of every scan.
+        if len(common) < len(devices):
+            tracked = self._devices
+            for mac in devices.viewkeys() - common:
+                if isinstance(mac, (int, long)):
+                    key = mac
+                elif len(mac) == 17 and mac[2] == ':' and mac == mac.lower():
+                    continue                                # the notation of the scanners, so it's not tracked.
+                else:
+                    try:
+                        key = macToInt(mac)
+                    except ValueError:
+                        continue
+                if key in tracked:
+                    result[key] = devices[mac]
+        return result
@@ -0,0 +1,76 @@
+"""
+    Shared access to the scans: a caller that asks for a scan while one is running waits for it and gets the same
+    result (single flight), and a result that is recent enough is returned without scanning at all.
+    So repeated refresh requests and the regular scan cycle never put more than 1 scan on the network at a time.
+"""
+
+import logging
+logger = logging.getLogger('arpscanner')
+import time
+from threading import Condition
+
+
+class ScanService(object):
+    """single flight execution and a short lived cache of the result of a scan function. Thread safe."""
+    def __init__(self, scanFunc):
+        """
+        :param scanFunc: the function that performs the scan.
+        """
+        self.scanFunc = scanFunc
+        self._cond = Condition()
+        self._running = False
+        self._generation = 0                # nr of scans that finished, so waiters know when theirs is done.
+        self._result = None
+        self._error = None
+        self._finished = None               # the time at which the last successful scan finished.
+
+    def getCached(self, maxAge):
+        """:return: the last result if it is not older than maxAge seconds, otherwise None."""
+        self._cond.acquire()
+        try:
+            if self._finished is not None and time.time() - self._finished <= maxAge:
+                return self._result
+            return None
+        finally:
+            self._cond.release()
+
+    def scan(self, maxAge, *args):
+        """
+        gets a scan result: a cached one, the one of the scan that is running or a new one.
+        :param maxAge: the max age of a cached result in seconds, 0 to never use the cache.
+        :param args: passed to the scan function, when a new scan is started.
+        :return: the result of the scan function, it's exception is raised again in every caller that waited for it.
+        """
+        self._cond.acquire()
+        try:
+            if maxAge and self._finished is not None and time.time() - self._finished <= maxAge:
+                return self._result
+            if self._running:
+                generation = self._generation
+                while self._generation == generation:
+                    self._cond.wait()
+                if self._error:
+                    raise self._error
+                return self._result
+            self._running = True
+        finally:
+            self._cond.release()
+        result = error = None
+        try:
+            result = self.scanFunc(*args)
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._cond.acquire()
+            try:
+                self._running = False
+                self._generation += 1
+                self._error = error
+                if not error:
+                    self._result = result
+                    self._finished = time.time()
+                self._cond.notifyAll()
+            finally:
+                self._cond.release()
@@ -0,0 +1,125 @@
+"""
+    Decides when each tracked device has to be probed (pinged) again.
+    Devices that keep answering are probed less and less often (up to a maximum interval),
+    devices that are suspected to have left are probed at a fast rate, so the departure is
+    confirmed quickly. The total nr of probes is capped, per batch and per second.
+"""
+
+import heapq, time
+
+
+class ProbeScheduler(object):
+    """
+    priority queue of devices, ordered on the time that they are due for their next probe.
+    """
+    def __init__(self, baseInterval=1.0, maxBackoff=8, suspectInterval=0.25, maxRate=200, maxBatch=256):
+        """
+        :param baseInterval: the nr of seconds between probes for a device that was just seen.
+        :param maxBackoff: the interval of stable devices grows up to baseInterval * maxBackoff.
+        :param suspectInterval: the nr of seconds between probes for devices that are suspected to have left.
+        :param maxRate: the max nr of probes per second.
+        :param maxBatch: the max nr of probes that are sent at the same time.
+        """
+        self.baseInterval = baseInterval
+        self.maxBackoff = maxBackoff
+        self.suspectInterval = suspectInterval
+        self.maxRate = maxRate
+        self.maxBatch = maxBatch
+        self._heap = []                     # (due time, mac)
+        self._due = {}                      # mac -> due time of the valid heap entry, other entries for the mac are stale. None while being probed.
+        self._intervals = {}                # mac -> current interval
+        self._tokens = float(maxRate)
+        self._lastRefill = time.time()
+        self._started = time.time()
+        self.probes = 0                     # total nr of probes that were handed out.
+
+    def _push(self, mac, due):
+        self._due[mac] = due
+        heapq.heappush(self._heap, (due, mac))
+
+    def sync(self, macs, now=None):
+        """
+        makes certain that exactly the devices in macs are scheduled. New devices are due right away.
+        :param macs: set of macs that need to be probed.
+        """
+        now = now or time.time()
+        current = self._due.viewkeys()
+        for mac in current - macs:
+            del self._due[mac]              # the heap entry becomes stale and is skipped.
+            self._intervals.pop(mac, None)
+        for mac in macs - current:
+            self._intervals[mac] = self.baseInterval
+            self._push(mac, now)
+
+    def expedite(self, mac, now=None):
+        """probe the device as soon as possible, ex: because it was missed by a scan."""
+        now = now or time.time()
+        due = self._due.get(mac)
+        if due is not None and due > now:
+            self._intervals[mac] = self.suspectInterval
+            self._push(mac, now)
+
+    def _refill(self, now):
+        self._tokens = min(float(self.maxRate), self._tokens + (now - self._lastRefill) * self.maxRate)
+        self._lastRefill = now
+
+    def getDue(self, now=None):
+        """
+        takes the devices that need to be probed now, within the rate and batch limits.
+        The devices have to be given back with reportResult.
+        :return: list of macs
+        """
+        now = now or time.time()
+        self._refill(now)
+        result = []
+        while self._heap and len(result) < self.maxBatch and self._tokens >= 1:
+            due, mac = self._heap[0]
+            if self._due.get(mac) != due:           # stale entry
+                heapq.heappop(self._heap)
+                continue
+            if due > now:
+                break
+            heapq.heappop(self._heap)
+            self._due[mac] = None
+            self._tokens -= 1
+            result.append(mac)
+        self.probes += len(result)
+        return result
+
+    def reportResult(self, mac, answered, suspect, now=None):
+        """
+        reschedules a device after it was probed.
+        :param answered: True if the device replied.
+        :param suspect: True if the device is suspected to have left (it missed a recent probe or scan).
+        """
+        if mac not in self._intervals:              # removed while it was being probed.
+            return
+        now = now or time.time()
+        if suspect or not answered:
+            interval = self.suspectInterval
+        else:
+            interval = min(max(self._intervals[mac], self.baseInterval) * 2, self.baseInterval * self.maxBackoff)
+        self._intervals[mac] = interval
+        self._push(mac, now + interval)
+
+    def nextDue(self):
+        """
+        :return: the time at which the next device is due, None if there are no devices. When the rate limit is
+                 reached, it's the time at which a few probes (50 ms worth) can be sent again, so the caller doesn't
+                 have to wake up for every single probe.
+        """
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        due = self._heap[0][0]
+        if self._tokens < 1:
+            needed = max(1.0, self.maxRate * 0.05)
+            due = max(due, self._lastRefill + (needed - self._tokens) / self.maxRate)
+        return due
+
+    def getStats(self, now=None):
+        """:return: dict with the nr of scheduled devices, the total nr of probes and the average nr of probes per second."""
+        now = now or time.time()
+        elapsed = max(now - self._started, 0.001)
+        return {'devices': len(self._due), 'probes': self.probes, 'probesPerSecond': self.probes / elapsed}
@@ -0,0 +1,79 @@
+"""
+    Local snapshot of the state of the tracked devices, so that a restart of the gateway resumes where it left off:
+    the presence, ip address, last seen time and missed count of every device.
+    The file is binary with fixed size records, so 10k+ devices load with a single unpack. It is replaced
+    atomically, a crash during a write leaves the previous snapshot.
+"""
+
+import logging
+logger = logging.getLogger('arpscanner')
+import os, socket, struct, time
+
+MAGIC = 'ARPS'
+VERSION = 1
+_header = struct.Struct('<4sHId')               # magic, version, nr of records, time of the snapshot
+_record = '<Q4sdHB'                             # mac, ip (0.0.0.0 = none), last seen, change count, present
+_record_size = struct.calcsize(_record)
+_no_ip = '\x00' * 4
+
+
+def pack(devices):
+    """
+    :param devices: iterable of registry.Tracked records.
+    :return: the content of the snapshot file.
+    """
+    values = []
+    count = 0
+    for tracked in devices:
+        values.extend((tracked.key, socket.inet_aton(tracked.ip) if tracked.ip else _no_ip, tracked.lastSeen or 0.0,
+                       min(tracked.changeCount, 0xFFFF), tracked.present))
+        count += 1
+    return _header.pack(MAGIC, VERSION, count, time.time()) + struct.pack('<' + _record[1:] * count, *values)
+
+
+def unpack(data):
+    """
+    :param data: the content of a snapshot file.
+    :return: dict of mac (as integer) -> (present, ip, lastSeen, changeCount). ip and lastSeen are None when unknown.
+    :raise ValueError: when the data is not a valid snapshot.
+    """
+    if len(data) < _header.size:
+        raise ValueError("snapshot too short")
+    magic, version, count, created = _header.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("unknown snapshot format")
+    if len(data) != _header.size + count * _record_size:
+        raise ValueError("snapshot is truncated")
+    values = struct.unpack_from('<' + _record[1:] * count, data, _header.size)
+    result = {}
+    for i in xrange(0, len(values), 5):
+        key, ip, lastSeen, changeCount, present = values[i:i + 5]
+        result[key] = (bool(present), socket.inet_ntoa(ip) if ip != _no_ip else None, lastSeen or None, changeCount)
+    return result
+
+
+def load(path):
+    """
+    reads a snapshot file.
+    :return: dict of mac (as integer) -> (present, ip, lastSeen, changeCount), empty when there is no (valid) snapshot.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return unpack(f.read())
+    except IOError:
+        return {}                                   # first start.
+    except (ValueError, struct.error) as e:
+        logger.error("ignoring snapshot %s: %s", path, e)
+        return {}
+
+
+def write(path, data):
+    """writes the snapshot (see pack) to a temporary file, which then replaces the previous one."""
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())                        # the rename must not become visible before the data is on disk.
+    if os.name == 'nt' and os.path.exists(path):   # rename doesn't replace on windows.
+        os.remove(path)
+    os.rename(temp, path)
@@ -0,0 +1,173 @@
+"""
+    Vendor names of the mac addresses, from the IEEE OUI list (http://standards-oui.ieee.org/oui/oui.txt, also
+    installed by the ieee-data and arp-scan packages), so the visible devices can be told apart.
+    The text file (30k+ entries) is compiled once into a small binary index: a sorted table of fixed size
+    records (24 bit prefix, offset and length of the name), followed by the names. The index is memory mapped
+    on the first lookup and searched by bisection, so nothing is loaded as long as no vendor is asked for.
+
+    From the command line:
+        python vendors.py compile oui.txt oui.idx
+        python vendors.py lookup oui.idx 00:1a:2b:3c:4d:5e ...
+"""
+
+import logging
+logger = logging.getLogger('arpscanner')
+import os, re, sys, bisect, mmap, struct
+
+import registry
+
+MAGIC = 'OUIX'
+VERSION = 1
+_header = struct.Struct('<4sHI')                # magic, version, nr of records
+_record = struct.Struct('<IIH')                 # prefix, offset of the name, length of the name
+_prefix = struct.Struct('<I')
+
+# 'AA-BB-CC   (hex)  name' and 'AABBCC   (base 16)  name' in the IEEE file, 'AABBCC<tab>name' in the arp-scan copy.
+_line_re = re.compile(r'^\s*([0-9A-Fa-f]{2})[-:]?([0-9A-Fa-f]{2})[-:]?([0-9A-Fa-f]{2})\s+(?:\((?:hex|base 16)\)\s*)?(\S.*?)\s*$')
+
+DEFAULT_SOURCES = ['/usr/share/ieee-data/oui.txt', '/usr/share/arp-scan/ieee-oui.txt', '/usr/share/misc/oui.txt']
+
+
+def parse(lines):
+    """
+    :param lines: the lines of an OUI text file.
+    :return: dict of prefix (24 bit integer) -> vendor name. The first name of a prefix is kept.
+    """
+    result = {}
+    for line in lines:
+        match = _line_re.match(line)
+        if match:
+            key = int(match.group(1) + match.group(2) + match.group(3), 16)
+            if key not in result:
+                result[key] = match.group(4)
+    return result
+
+
+def pack(vendors):
+    """
+    :param vendors: dict of prefix -> vendor name, as returned by parse.
+    :return: the content of the index file.
+    """
+    records = []
+    names = []
+    offset = 0
+    for key in sorted(vendors):
+        name = vendors[key][:0xFFFF]
+        records.append(_record.pack(key, offset, len(name)))
+        names.append(name)
+        offset += len(name)
+    return _header.pack(MAGIC, VERSION, len(records)) + ''.join(records) + ''.join(names)
+
+
+def compileIndex(source, target):
+    """
+    compiles an OUI text file into an index file. The index is replaced atomically.
+    :return: the nr of vendors in the index.
+    """
+    with open(source, 'r') as f:
+        vendors = parse(f)
+    temp = target + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(pack(vendors))
+    if os.name == 'nt' and os.path.exists(target):     # rename doesn't replace on windows.
+        os.remove(target)
+    os.rename(temp, target)
+    return len(vendors)
+
+
+def findSource(sources=None):
+    """:return: the first of the OUI text files that exists, or None."""
+    for path in DEFAULT_SOURCES if sources is None else sources:
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def openIndex(path, sources=None):
+    """
+    opens an index, it is (re)compiled first when it is missing or older than the OUI text file.
+    :param path: the index file.
+    :param sources: the OUI text files that are searched, the first one that exists is used.
+    :return: a VendorIndex, or None when there is no index and no text file to compile it from.
+    """
+    source = findSource(sources)
+    if source and (not os.path.isfile(path) or os.path.getmtime(path) < os.path.getmtime(source)):
+        logger.info("compiling vendor index %s from %s", path, source)
+        compileIndex(source, path)
+    if not os.path.isfile(path):
+        return None
+    return VendorIndex(path)
+
+
+class _Prefixes(object):
+    """the prefixes of the records in a mapped index, as a sequence, so bisect can search them."""
+    def __init__(self, data, count):
+        self.data = data
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return _prefix.unpack_from(self.data, _header.size + index * _record.size)[0]
+
+
+class VendorIndex(object):
+    """lookups in an index file. The file is only mapped on the first lookup. Thread safe once it is mapped."""
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+        self._prefixes = None
+        self._names = 0                     # the offset of the names in the file.
+
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _header.size:
+                raise ValueError("vendor index too short: %s" % self.path)
+            data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        magic, version, count = _header.unpack_from(data)
+        if magic != MAGIC or version != VERSION or size < _header.size + count * _record.size:
+            data.close()
+            raise ValueError("unknown vendor index format: %s" % self.path)
+        self._names = _header.size + count * _record.size
+        self._prefixes = _Prefixes(data, count)
+        self._data = data
+
+    def lookup(self, mac):
+        """
+        :param mac: the mac address, in any notation or as an integer.
+        :return: the name of the vendor, or None when it is unknown.
+        """
+        if self._data is None:
+            self._open()
+        key = registry.macToInt(mac) >> 24
+        index = bisect.bisect_left(self._prefixes, key)
+        if index == len(self._prefixes):
+            return None
+        prefix, offset, length = _record.unpack_from(self._data, _header.size + index * _record.size)
+        if prefix != key:
+            return None
+        start = self._names + offset
+        return self._data[start:start + length]
+
+    def __len__(self):
+        if self._data is None:
+            self._open()
+        return len(self._prefixes)
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == 'compile':
+        print "%d vendors" % compileIndex(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) >= 4 and sys.argv[1] == 'lookup':
+        index = VendorIndex(sys.argv[2])
+        for mac in sys.argv[3:]:
+            print mac, index.lookup(mac)
+    else:
+        print "usage: python vendors.py compile <oui.txt> <index> | lookup <index> <mac> [<mac> ...]"
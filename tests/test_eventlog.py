@@ -0,0 +1,100 @@
+"""
+    Tests of the event log queries: a random history of joins and departures is written over many small segments
+    and every query is compared with a brute force replay of the same history.
+    usage: python -m unittest discover tests
+"""
+
+import os, sys, random, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pygate_arpscanner'))
+import eventlog
+
+
+class EventLogReplayTest(unittest.TestCase):
+    DEVICES = 50
+    EVENTS = 5000
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='arpscanner-events-')
+        self.random = random.Random(1)
+        self.present = {}                           # mac -> ip, the state while the log is written.
+        self.history = []                           # list of (time, mac, ip, present)
+        log = eventlog.EventLog(self.directory, lambda: self.present.items(), segmentSize=200 * eventlog.RECORD_SIZE, maxSegments=1000)
+        when = 1000.0
+        for index in xrange(self.EVENTS):
+            when = round(when + self.random.uniform(0.01, 2), 3)
+            mac = self.random.randrange(self.DEVICES) + 1
+            ip = '10.0.%d.%d' % (mac, self.random.randrange(1, 255))
+            present = mac not in self.present
+            log.append(when, mac, ip, 0.001, present)     # like setPresent: logged before the state changes.
+            if present:
+                self.present[mac] = ip
+            else:
+                del self.present[mac]
+            self.history.append((when, mac, ip, present))
+        log.close()
+        self.first = self.history[0][0]
+        self.last = self.history[-1][0]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def presentAt(self, when):
+        present = {}
+        for time, mac, ip, joined in self.history:
+            if time > when:
+                break
+            if joined:
+                present[mac] = ip
+            else:
+                present.pop(mac, None)
+        return present
+
+    def dwellTimes(self, start, end):
+        since = {}
+        result = {}
+        for time, mac, ip, joined in self.history:
+            if joined:
+                since[mac] = time
+                continue
+            joinedAt = since.pop(mac)
+            overlap = min(time, end) - max(joinedAt, start)
+            if overlap > 0:
+                result[mac] = result.get(mac, 0.0) + overlap
+        for mac, joinedAt in since.iteritems():
+            overlap = end - max(joinedAt, start)
+            if overlap > 0:
+                result[mac] = result.get(mac, 0.0) + overlap
+        return result
+
+    def times(self, count):
+        """random times over the whole history, plus the edges and times before and after it."""
+        result = [self.first - 10, self.first, self.last, self.last + 10]
+        result += [time for time, mac, ip, present in self.history[::len(self.history) // 20]]     # on an event.
+        result += [self.random.uniform(self.first, self.last) for index in xrange(count)]
+        return result
+
+    def testSegments(self):
+        self.assertTrue(len(eventlog.listSegments(self.directory)) >= 20)
+
+    def testReadEvents(self):
+        events = [event for event in eventlog.readEvents(self.directory) if event.kind != eventlog.STATE]
+        self.assertEqual([(event.time, event.mac, event.ip, event.kind == eventlog.JOIN) for event in events], self.history)
+
+    def testPresentAt(self):
+        for when in self.times(200):
+            self.assertEqual(eventlog.presentAt(self.directory, when), self.presentAt(when), "presentAt(%r)" % when)
+
+    def testDwellTimes(self):
+        times = self.times(100)
+        windows = [(self.first - 10, self.last + 10)] + [tuple(sorted(self.random.sample(times, 2))) for index in xrange(100)]
+        for start, end in windows:
+            expected = self.dwellTimes(start, end)
+            result = eventlog.dwellTimes(self.directory, start, end)
+            self.assertEqual(sorted(mac for mac in result if result[mac] > 1e-6), sorted(expected), "dwellTimes(%r, %r)" % (start, end))
+            for mac, seconds in expected.iteritems():
+                self.assertAlmostEqual(result[mac], seconds, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
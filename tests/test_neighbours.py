@@ -0,0 +1,45 @@
+"""
+    Tests of the kernel neighbour table backend, with recorded netlink messages.
+    usage: python -m unittest discover tests
+"""
+
+import os, sys, socket, struct, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pygate_arpscanner'))
+import neighbours
+
+
+def neighMessage(msgType, state, ip, mac=None):
+    """builds a netlink neighbour message, as the kernel sends it."""
+    attrs = struct.pack('=HH', 8, neighbours.NDA_DST) + socket.inet_aton(ip)
+    if mac:
+        raw = ''.join(chr(int(part, 16)) for part in mac.split(':'))
+        attrs += struct.pack('=HH', 10, neighbours.NDA_LLADDR) + raw + '\x00\x00'
+    body = neighbours._NDMSG.pack(socket.AF_INET, 0, 0, 2, state, 0, 1) + attrs
+    return neighbours._NLMSGHDR.pack(neighbours._NLMSGHDR.size + len(body), msgType, 0, 0, 0) + body
+
+
+class NeighbourMonitorTest(unittest.TestCase):
+    def setUp(self):
+        self.changes = []
+        self.monitor = neighbours.NeighbourMonitor(lambda present, mac, ip: self.changes.append((present, mac, ip)))
+
+    def testIncompleteEntryOfUnknownAddress(self):
+        data = (neighMessage(neighbours.RTM_NEWNEIGH, 0x02, '10.9.9.2', '1e:5a:cb:41:e9:06') +
+                neighMessage(neighbours.RTM_NEWNEIGH, neighbours.NUD_INCOMPLETE, '10.9.9.77') +
+                neighMessage(neighbours.RTM_NEWNEIGH, neighbours.NUD_FAILED, '10.9.9.78', '02:00:00:00:00:4e'))
+        messages = neighbours.parseNeighMessages(data)
+        self.assertEqual([present for present, mac, ip in messages], [True, False, False])
+        self.monitor.apply(messages)
+        self.assertEqual(self.monitor.getDevices(), {'1e:5a:cb:41:e9:06': '10.9.9.2'})
+        self.assertEqual(self.changes, [(True, '1e:5a:cb:41:e9:06', '10.9.9.2')])
+
+    def testDeleteWithoutMac(self):
+        self.monitor.apply(neighbours.parseNeighMessages(neighMessage(neighbours.RTM_NEWNEIGH, 0x02, '10.9.9.2', '1e:5a:cb:41:e9:06')))
+        self.monitor.apply(neighbours.parseNeighMessages(neighMessage(neighbours.RTM_DELNEIGH, 0x02, '10.9.9.2')))
+        self.assertEqual(self.monitor.getDevices(), {})
+        self.assertEqual(self.changes[-1], (False, '1e:5a:cb:41:e9:06', '10.9.9.2'))
+
+
+if __name__ == '__main__':
+    unittest.main()
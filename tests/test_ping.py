@@ -0,0 +1,71 @@
+"""
+    Tests of the echo request template: the packets must be valid and identical to the ones that were built
+    before the template, when the whole checksum was calculated for every packet.
+    usage: python -m unittest discover tests
+"""
+
+import os, sys, socket, struct, random, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pygate_arpscanner'))
+import ping
+
+
+def legacyChecksum(source_string):
+    """the checksum as it was calculated before: 1 byte at a time."""
+    sum = 0
+    countTo = (len(source_string)/2)*2
+    count = 0
+    while count<countTo:
+        thisVal = ord(source_string[count + 1])*256 + ord(source_string[count])
+        sum = sum + thisVal
+        sum = sum & 0xffffffff
+        count = count + 2
+    if countTo<len(source_string):
+        sum = sum + ord(source_string[len(source_string) - 1])
+        sum = sum & 0xffffffff
+    sum = (sum >> 16)  +  (sum & 0xffff)
+    sum = sum + (sum >> 16)
+    answer = ~sum
+    answer = answer & 0xffff
+    answer = answer >> 8 | (answer << 8 & 0xff00)
+    return answer
+
+
+def legacyPacket(ID, sequence, timestamp):
+    """builds the packet the way send_one_ping used to."""
+    header = struct.pack("bbHHh", ping.ICMP_ECHO_REQUEST, 0, 0, ID, sequence)
+    bytesInDouble = struct.calcsize("d")
+    data = struct.pack("d", timestamp) + (192 - bytesInDouble) * "Q"
+    my_checksum = legacyChecksum(header + data)
+    header = struct.pack("bbHHh", ping.ICMP_ECHO_REQUEST, 0, socket.htons(my_checksum), ID, sequence)
+    return header + data
+
+
+class EchoTemplateTest(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(1)
+
+    def testChecksum(self):
+        for length in range(0, 40) + [200]:
+            data = ''.join(chr(self.random.randrange(256)) for i in xrange(length))
+            self.assertEqual(ping.checksum(data), legacyChecksum(data))
+
+    def testSameAsLegacyPacket(self):
+        for ID in (0, 1, 0x1234, 0xFFFF):
+            template = ping.EchoTemplate(ID)
+            for sequence in [0, 1, 0x7FFF, -1] + [self.random.randrange(0x8000) for i in xrange(50)]:
+                timestamp = self.random.uniform(0, 2e9)
+                packet = template.build(sequence, timestamp)
+                self.assertEqual(packet, legacyPacket(ID, sequence, timestamp))
+                self.assertEqual(ping.checksum(packet), 0)          # a valid packet sums to 0.
+
+    def testParseReply(self):
+        packet = ping.EchoTemplate(77).build(5, 100.0)
+        reply = '\x45' + '\x00' * 19 + '\x00' + packet[1:]         # ip header + echo reply (type 0)
+        self.assertEqual(ping.parse_reply(reply, 77, 100.25), (5, 0.25))
+        self.assertEqual(ping.parse_reply(reply, 78, 100.25), None)
+        self.assertEqual(ping.parse_reply('\x45' + '\x00' * 19 + packet, 77, 100.25), None)     # our own request.
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+    Tests of the publisher's queue, with a stub device.Device.
+    usage: python -m unittest discover tests
+"""
+
+import os, sys, time, unittest
+from threading import Event
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pygate_arpscanner'))
+import publisher
+
+
+class StubDevice(object):
+    """records the values that are sent, a send fails for the assets in 'failing'."""
+    def __init__(self):
+        self.sent = []                              # list of (time, assetId, value)
+        self.failing = set()
+        self.gate = None                            # when set, the sends wait for this event.
+
+    def send(self, value, assetId):
+        if self.gate:
+            self.gate.wait()
+        if assetId in self.failing:
+            raise IOError("send failed")
+        self.sent.append((time.time(), assetId, value))
+
+
+class PublisherTest(unittest.TestCase):
+    def setUp(self):
+        self.device = StubDevice()
+        self.publisher = None
+
+    def tearDown(self):
+        if self.device.gate:
+            self.device.gate.set()
+        if self.publisher and self.publisher.is_alive():
+            self.publisher.stop()
+            self.publisher.join(1)
+
+    def start(self, **kwargs):
+        self.publisher = publisher.Publisher(self.device, **kwargs)
+        self.publisher.start()
+        return self.publisher
+
+    def waitForSends(self, count, timeout=2):
+        end = time.time() + timeout
+        while len(self.device.sent) < count and time.time() < end:
+            time.sleep(0.005)
+
+    def testCoalesce(self):
+        queue = self.start(window=0.1)
+        queue.publish('true', 'a')
+        queue.publish('false', 'a')
+        queue.publish('true', 'b')
+        queue.publish('true', 'a')
+        self.waitForSends(2)
+        time.sleep(0.05)
+        self.assertEqual([(assetId, value) for at, assetId, value in self.device.sent], [('a', 'true'), ('b', 'true')])
+        stats = queue.getStats()
+        self.assertEqual((stats['sent'], stats['merged'], stats['depth']), (2, 2, 0))
+
+    def testMerge(self):
+        queue = self.start(window=0.1)
+        queue.publish([1], 'a', lambda queued, value: queued + value)
+        queue.publish([2], 'a', lambda queued, value: queued + value)
+        self.waitForSends(1)
+        self.assertEqual(self.device.sent[0][1:], ('a', [1, 2]))
+
+    def testWindow(self):
+        queue = self.start(window=0.2)
+        start = time.time()
+        for index in xrange(20):                    # every publish wakes the sender, the window still holds them back.
+            queue.publish('true', str(index))
+            time.sleep(0.005)
+        self.waitForSends(20)
+        self.assertEqual(len(self.device.sent), 20)
+        self.assertTrue(self.device.sent[0][0] - start >= 0.19)
+        self.assertEqual(queue.latency.count, 1)    # 1 batch.
+
+    def testFlush(self):
+        queue = self.start(window=10)
+        queue.publish('true', 'a')
+        queue.flush()
+        self.waitForSends(1)
+        self.assertEqual(len(self.device.sent), 1)
+
+    def testDrop(self):
+        self.device.gate = Event()                  # the sender is stuck on the network.
+        queue = self.start(maxSize=2, window=0)
+        queue.publish('true', 'a')
+        time.sleep(0.05)                            # 'a' is being sent, the queue is empty again.
+        self.assertTrue(queue.publish('true', 'b'))
+        self.assertTrue(queue.publish('true', 'c'))
+        self.assertFalse(queue.publish('true', 'd'))
+        self.assertTrue(queue.publish('false', 'b'))        # replaces a queued value, so there is room.
+        stats = queue.getStats()
+        self.assertEqual((stats['dropped'], stats['merged'], stats['depth']), (1, 1, 2))
+        self.device.gate.set()
+        self.waitForSends(3)
+        self.assertEqual(sorted(assetId for at, assetId, value in self.device.sent), ['a', 'b', 'c'])
+
+    def testFailure(self):
+        failed = []
+        self.device.failing.add('a')
+        queue = publisher.Publisher(self.device, window=0)
+        queue.onFailed = failed.append
+        self.publisher = queue
+        queue.start()
+        queue.publish('true', 'a')
+        queue.publish('true', 'b')
+        self.waitForSends(1)
+        time.sleep(0.05)
+        self.assertEqual(failed, ['a'])
+        stats = queue.getStats()
+        self.assertEqual((stats['sent'], stats['failed']), (1, 1))
+
+    def testStopDrains(self):
+        queue = self.start(window=10)
+        for index in xrange(5):
+            queue.publish('true', str(index))
+        queue.stop()
+        queue.join(2)
+        self.assertFalse(queue.is_alive())
+        self.assertEqual(len(self.device.sent), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()